@@ -2,30 +2,39 @@ import argparse
 import numpy as np
 import pandas as pd
 import Tools as tools
+import rendering
+import mapping
+import profiling
 
 parser = argparse.ArgumentParser(description="A script that chooses between --channel and --module.")
 parser.add_argument("--txt_file",  action="store_true", help="Read the geometry from Pedro's txt file or from Andy's xml file")
+parser.add_argument("--txt_geometry", default=tools.GEOMETRY_TXT, help="Pedro's txt file read with --txt_file (geometry.15.3.txt or geometry.hgcal.txt)")
 parser.add_argument("--sector120", action="store_true", help="Display 60 or 120 sector")
+rendering.add_arguments(parser, html=False)
+profiling.add_arguments(parser)
 args = parser.parse_args()
+profiling.configure(args)
 
 if args.txt_file:
-    geometry = tools.prepare_geometry_txt()
+    geometry = tools.prepare_geometry_txt(args.txt_geometry)
     geometry = geometry.rename(columns={"trigLinks": "TriggerLpGbts"})
 else:
-    geometry_file = 'xml/Geometry.xml'
-    geometry = tools.extract_module_info_from_xml(geometry_file)
+    geometry = mapping.load_model().geometry.copy()
 
-geometry['x0'] = geometry['hex_x'].apply(np.mean)
-geometry['y0'] = geometry['hex_y'].apply(np.mean)
+geometry['x0'], geometry['y0'] = tools.ModulePolygons.from_frame(geometry).centroid().T
 
 if not args.sector120: # and not args.txt_file:
-    regions = tools.extract_60regions_MB_from_xml("xml/Regions.60.NoSplit.xml")
+    regions = mapping.load_model().regions60
     geometry = pd.merge(geometry, regions[regions.lr=='1'], on=['MB','plane'], how='inner')
 
-for plane in geometry.plane.unique():
-    print("Processing layer ", plane)
+with rendering.pool(args):
+    for plane in geometry.plane.unique():
+        df_layer = geometry[geometry.plane == plane].copy()
+        inputs = rendering.fingerprint(df_layer[['Module', 'MB', 'u', 'v', 'TriggerLpGbts']], tools.ModulePolygons.from_frame(df_layer).xy)
+        if not rendering.wanted("layer"+str(plane)+"_MB_60sector", inputs): continue
+        print("Processing layer ", plane)
 
-    df_layer = geometry[geometry.plane == plane].copy()
-    scatter, annotations = tools.plot_modules(df_layer, 'MB')
-    tools.set_figure(scatter, annotations, str(plane))
+        with profiling.span('layer', plane=plane):
+            scatter, annotations = tools.plot_modules(df_layer, 'MB', batched=True)
+            tools.set_figure(scatter, annotations, str(plane), fingerprint=inputs)
 
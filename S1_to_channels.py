@@ -12,8 +12,13 @@ import shapely
 from shapely.geometry import Point, Polygon
 
 import Tools as tools
+import rendering
+import mapping
+import dashboard
+import columns
+import profiling
 
-def plotting_frames(df, layer, args):
+def plotting_frames(df, layer, args, fingerprint=None):
     ''' generic plotting function to create different scatter
         plots based on the options in args '''
 
@@ -35,10 +40,10 @@ def plotting_frames(df, layer, args):
         xaxis_title='column',
         yaxis_title='φ coordinate' if args.phi else 'φ-ordered modules',
     )
-    tools.save_figure(fig, layer, args)
+    tools.save_figure(fig, layer, args, fingerprint)
     return fig
 
-def plotting_histo(df, layer, args):
+def plotting_histo(df, layer, args, fingerprint=None):
     fig = df['coord'].plot(kind = 'hist')
 
     fig.update_layout(
@@ -50,42 +55,66 @@ def plotting_histo(df, layer, args):
     )
 
     title = "Histogram_frame_column_layer_" +str(layer)
-    fig.write_image(title+".pdf")
-    fig.write_image(title+".png")
+    rendering.write_figure(fig, title, fingerprint=fingerprint)
     tools.save_csv(df, layer, args)
 
+def column_highlights(df, columns):
+    ''' modules of the layer and, lazily for each column, the mask of the
+        modules having frames in it. The module x column membership matrix
+        is built from a single groupby, no copy of the frames is made '''
+    df_modules = df.drop_duplicates('Module_id')
+    pairs = df.groupby(['Module_id', 'Column'], observed=True).size().index
+    rows = pd.Index(df_modules['Module_id']).get_indexer(pairs.get_level_values('Module_id'))
+    first = min(columns)
+    cols = pairs.get_level_values('Column').to_numpy().astype(int) - first
+    inside = (cols >= 0) & (cols <= max(columns) - first)
+
+    membership = np.zeros((len(df_modules), max(columns) - first + 1), dtype=bool)
+    membership[rows[inside], cols[inside]] = True
+
+    def highlights():
+        for column in columns:
+            yield column, membership[:, column - first]
+    return df_modules, highlights()
+
+@profiling.profiled('figure.module_maps')
 def create_maps(df, layer):
     offset = -4 # including the negative columns
-    radius = df['hex_x'].apply(lambda x: max(x)).max()
+    df_modules, highlights = column_highlights(df, [column + offset for column in range(84+offset)])
+    polygons = tools.ModulePolygons.from_frame(df_modules)
+    radius = polygons.bounds()[:, 2].max()
     x_slice, y_slice = tools.create_slices(radius, offset=-4)
+    layer_inputs = rendering.fingerprint(df_modules[['Module_id', 'u', 'v']], polygons.xy)
 
-    for column in range(84+offset):
-        column = column + offset
-        df = df.sort_values(by='Column', key=lambda x: x != column)
-        df_layer = df.drop_duplicates('Module').copy()
-        scatter, annotations = tools.plot_modules(df_layer, column)
+    for column, highlight in highlights:
+        title = "S1toChannels_module_layer_" +str(layer)+"_Column"+str(column)
+        inputs = rendering.fingerprint(layer_inputs, df_modules['Module_id'].to_numpy()[highlight])
+        if not rendering.wanted(title, inputs): continue
+
+        scatter, annotations = tools.plot_modules(df_modules, column, batched=True, highlight=highlight, polygons=polygons)
         fig = go.Figure(scatter)
         fig.update_layout(width=1100, height=900)
         fig.update_layout(annotations=annotations, showlegend=False, title='Display layer '+str(layer)+', Column'+str(column))
   
         fig.add_trace(go.Scatter(x=x_slice[column-offset],   y=y_slice[column-offset],   mode='lines', line=dict(color='blue')))
         fig.add_trace(go.Scatter(x=x_slice[column-offset+1], y=y_slice[column-offset+1], mode='lines', line=dict(color='blue')))
-    
-        title = "S1toChannels_module_layer_" +str(layer)+"_Column"+str(column)
-        fig.write_image(title+".pdf")
-        fig.write_image(title+".png")
+        rendering.write_figure(fig, title, fingerprint=inputs)
 
+@profiling.profiled('figure.scatter')
 def create_scatter_plot(scatter_df, layer, args):
     if args.sector60: scatter_df = scatter_df[scatter_df['MB'] < 100].copy()
+    # every frame counts (--frame colours, histograms), not only the last one of a (module, column)
+    inputs = rendering.fingerprint(scatter_df[['Module', 'Column', 'Frame', 'Channel', 'u', 'v', 'phi']],
+                                   args.sector60, args.phi, args.channel, args.module, args.frame)
     
     scatter_df['coord'] = "(" + scatter_df['u'].astype(str) + "," + scatter_df['v'].astype(str) + ")"
     scatter_df['rank'] = scatter_df['phi'] if args.phi else scatter_df['phi'].rank(method='dense')
     
     if args.frame: scatter_df['occurrence'] = scatter_df.groupby(['Module','Column']).cumcount().add(1).mul(3).astype(str)
     if args.histo: scatter_df = scatter_df.sort_values(by=['phi'])
-    else: scatter_df = scatter_df.sort_values(by=['Module', 'Column']).drop_duplicates(['Module', 'Column'], 'last')
+    else: scatter_df = scatter_df.sort_values(by=['Module', 'Column']).drop_duplicates(['Module', 'Column'], keep='last')
 
-    plotting_histo(scatter_df, layer, args) if args.histo else plotting_frames(scatter_df, layer, args) 
+    plotting_histo(scatter_df, layer, args, inputs) if args.histo else plotting_frames(scatter_df, layer, args, inputs) 
 
 def create_custom_legend(fig):
     custom_legend_traces = [
@@ -96,37 +125,38 @@ def create_custom_legend(fig):
     for trace in custom_legend_traces:
         fig.add_trace(trace)
 
+@profiling.profiled('figure.frame_maps')
 def create_slice_plot(df, layer):
+    title = "slice_plot_layer_"+str(layer)
+    inputs = rendering.fingerprint(df[['Module_id', 'Column', 'u', 'v']], tools.ModulePolygons.from_frame(df.drop_duplicates('Module_id')).xy)
+    if not rendering.wanted(title, inputs): return
     fig = go.Figure()
-    center = Point(0,0)
-    radius = df['hex_x'].apply(lambda x: max(x)).max() + 300
-    annotations = []
-
-    df['occurrence'] = df.groupby(['Module','Column']).cumcount().add(1).astype(str)
-    df = df.sort_values(by=['Module', 'Column']).drop_duplicates(['Module', 'Column'], 'last')
-    for module in df.Module.unique():
-        df_module = df[df.Module == module]
-        hexagon = tools.create_hexagon(df_module) 
-        for i in range(-10,85):
-            sector = tools.create_sector(center, math.radians(i*120/84), math.radians((i+1)*120/84), radius)
-            module = hexagon.intersection(sector)
-            if module.is_empty or isinstance(module, Point): continue
-            x, y = module.exterior.coords.xy
-
-            TCs = df_module['occurrence'][df_module.Column == i]
-            color = tools.colors[int(TCs)] if not TCs.empty else 'white'
-            fig.add_trace(go.Scatter(x=np.array(x), y=np.array(y), fill="toself", fillcolor=color,
-                          line=dict(color='rgba(0,0,0)', width=0.5), mode='lines', showlegend=False))
-
-        module_info = df_module.iloc[0]
-        text = '('+str(module_info['u'])+','+str(module_info['v'])+')'
-        annotations.append(go.layout.Annotation(x=module_info['x0'], y=module_info['y0'], text=text, showarrow=False, font=dict(color='black')))
+
+    df['occurrence'] = df.groupby(['Module_id','Column']).cumcount().add(1)
+    df = df.sort_values(by=['Module_id', 'Column']).drop_duplicates(['Module_id', 'Column'], keep='last')
+    df_modules = df.drop_duplicates('Module_id')
+    polygons = tools.ModulePolygons.from_frame(df_modules)
+    radius = polygons.bounds()[:, 2].max() + 300
+
+    # (module, column) pieces depend on the geometry only, frames give their colour
+    module_idx, column, pieces = columns.module_column_pieces(polygons, radius)
+    TCs = pd.Series(df['occurrence'].to_numpy(), index=pd.MultiIndex.from_arrays([df['Module_id'], df['Column'].astype(int)]))
+    TCs = TCs.reindex(pd.MultiIndex.from_arrays([df_modules['Module_id'].to_numpy()[module_idx], column]))
+    piece_colors = TCs.map(tools.colors).fillna('white').to_numpy()
+
+    pieces = tools.ModulePolygons.from_shapely(pieces)
+    for color in pd.unique(piece_colors):
+        x, y = np.round(pieces.take(piece_colors == color).paths(), 3)
+        fig.add_trace(go.Scatter(x=x, y=y, fill="toself", fillcolor=color,
+                      line=dict(color='rgba(0,0,0)', width=0.5), mode='lines', showlegend=False))
+
+    annotations = [go.layout.Annotation(x=x0, y=y0, text='('+str(u)+','+str(v)+')', showarrow=False, font=dict(color='black'))
+                   for x0, y0, u, v in df_modules[['x0', 'y0', 'u', 'v']].itertuples(index=False)]
 
     create_custom_legend(fig)
     fig.update_layout(annotations=annotations, title='TCs distribution in each frame*column in layer '+str(layer))
     
-    fig.write_image("slice_plot_layer_"+str(layer)+".pdf")
-    fig.write_image("slice_plot_layer_"+str(layer)+".png")
+    rendering.write_figure(fig, title, fingerprint=inputs)
 
 def create_plot(df, args):
     ''' crates a dictionary: keys == HGCAL layers,
@@ -135,11 +165,12 @@ def create_plot(df, args):
     df_layer = {}
     for plane in df['plane'].unique():
         print("Processing layer ", str(plane))
-        df_layer[plane] = df[df['plane'] == plane].reset_index(drop=True)
+        with profiling.span('layer', plane=plane):
+            df_layer[plane] = df[df['plane'] == plane].reset_index(drop=True)
 
-        if args.scatter or args.histo: create_scatter_plot(df_layer[plane], plane, args)
-        if args.module_maps:           create_maps(df_layer[plane], plane)
-        if args.frame_maps:            create_slice_plot(df_layer[plane], plane)
+            if args.scatter or args.histo: create_scatter_plot(df_layer[plane], plane, args)
+            if args.module_maps:           create_maps(df_layer[plane], plane)
+            if args.frame_maps:            create_slice_plot(df_layer[plane], plane)
 
 if __name__ == "__main__":
     ''' python S1_to_channels.py --scatter'''
@@ -154,11 +185,23 @@ if __name__ == "__main__":
     parser.add_argument("--module",      action="store_true", help="Color based on the module ids")
     parser.add_argument("--frame",       action="store_true", help="Color based on the number of frames in each module x column")
     parser.add_argument("--histo",       action="store_true", help="produce histograms")
+    parser.add_argument("--allocation",  default='xml/S1toChannels.SeparateTD.120.SingleTypes.NoSplit.xml', help="S1toChannels (or ChannelAllocation) xml file")
+    parser.add_argument("--geometry",    default='xml/Geometry.xml', help="Geometry xml file")
+    rendering.add_arguments(parser)
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.configure(args)
+
+    allocation_file = args.allocation
+    geometry_file = args.geometry
 
-    tree = ET.parse('xml/S1toChannels.SeparateTD.120.SingleTypes.NoSplit.xml')
-    geometry_file = 'xml/Geometry.xml'
+    model = mapping.load_model(geometry_file=geometry_file, allocation_file=allocation_file)
+    df = model.frames
+    for det, key in [('si', 'Module'), ('sci', 'MB')]:
+        outside = model.overlap_index(key).validate(df[det])
+        if len(outside): print(f"Warning: {len(outside)} {det} frames are sent to columns their {key} does not overlap")
 
-    df = tools.extract_data(tree, geometry_file)
-    create_plot(df, args)
+    if args.html: dashboard.write_dashboard(model, args.html)
+    with rendering.pool(args):
+        create_plot(df['si'], args)
 
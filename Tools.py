@@ -1,3 +1,4 @@
+import io
 import numpy as np
 import pandas as pd
 import math
@@ -9,6 +10,11 @@ from shapely.geometry import Point, Polygon
 
 import xml.etree.ElementTree as ET
 
+import xml_cache
+import rendering
+import hgcal_ids
+import profiling
+
 colors = {0  : 'white',
           1  : 'cornflowerblue',
           2  : 'orange',
@@ -19,38 +25,48 @@ class Region:
         self.id = id
         self.MBs = Motherboards
 
-def read_regions_xml_file():
+@xml_cache.cached('regions')
+def read_regions_table(xml_file):
+    ''' one row per (Region, Motherboard) reference '''
     # Parse the XML file content
-    tree = ET.parse("xml/Regions.120.NoSplit.xml")
+    tree = ET.parse(xml_file)
     root = tree.getroot()
 
-    # Create Region objects for each Region element
-    regions = []
+    rows = []
     for region_elem in root.findall(".//Region"):
         id = region_elem.get("id")
-        Motherboards = []
-        for motherboard_element in region_elem.findall('Motherboard'):
-            Motherboards.append(motherboard_element.get('href'))
-
-        region = Region(id, Motherboards)
-        regions.append(region)
-    return regions
+        Motherboards = [motherboard_element.get('href') for motherboard_element in region_elem.findall('Motherboard')]
+        rows.extend({'Region': id, 'MB': MB} for MB in (Motherboards or ['']))
+    return pd.DataFrame(rows, columns=['Region', 'MB'])
+
+REGION_LOADS = ['TCcount', 'TriggerLpGbts', 'DaqRate']
+
+@xml_cache.cached('region_loads')
+def read_region_loads(xml_file):
+    ''' TCcount, TriggerLpGbts and DaqRate of every region of a Regions xml
+        (60 or 120 degree), 0 where missing (TCcount="None" of the DAQ regions) '''
+    root = ET.parse(xml_file).getroot()
+    rows = [[region.get('id')] + [region.get(column) for column in REGION_LOADS] for region in root.iter('Region')]
+    df = pd.DataFrame(rows, columns=['Region'] + REGION_LOADS)
+    df[REGION_LOADS] = df[REGION_LOADS].apply(pd.to_numeric, errors='coerce').fillna(0.)
+    return df
 
-def get_modules_per_S1(regions):
-    all_regions = read_regions_xml_file()
-    geometry_file = 'xml/Geometry.xml'
-    geometry = extract_module_info_from_xml(geometry_file)
+def read_regions_xml_file(xml_file="xml/Regions.120.NoSplit.xml"):
+    # Create Region objects for each Region element
+    table = read_regions_table(xml_file)
 
-    modules = 0
-    for region in regions:
-        print(f"Region ID: {region}")
-        MB_ids_for_region = get_MB_ids(all_regions, region)
+    regions = []
+    for id, Motherboards in table.groupby('Region', sort=False)['MB']:
+        regions.append(Region(id, [MB for MB in Motherboards if MB]))
+    return regions
 
-        df_region = pd.DataFrame(columns=['MB', 'plane'])
-        for MB_id in MB_ids_for_region:
-            modules += len(geometry[geometry.MB == MB_id]['Module'])
-     
-    return modules
+def get_modules_per_S1(regions, regions_file="xml/Regions.120.NoSplit.xml", geometry_file="xml/Geometry.xml"):
+    ''' number of modules in the motherboards of the given regions, counted as
+        hierarchy.MappingHierarchy.region_totals does, from the cached tables '''
+    region_MBs = read_regions_table(regions_file)
+    MBs = region_MBs.loc[region_MBs['Region'].isin(list(regions)), 'MB']
+    modules = extract_module_info_from_xml(geometry_file).drop_duplicates('Module')
+    return int(modules['MB'].value_counts().reindex(MBs, fill_value=0).sum())
 
 def create_sector(center, start_angle, end_angle, radius, steps=2):
     def polar_point(origin_point, angle,  distance):
@@ -80,57 +96,215 @@ def create_hexagon(df):
     return Polygon(vertices)
 
 def phi_calculator(df):
-    df['x0'] = df['hex_x'].apply(np.mean)
-    df['y0'] = df['hex_y'].apply(np.mean)
+    df['x0'], df['y0'] = ModulePolygons.from_frame(df).centroid().T
     return np.arctan2(df['y0'], df['x0'])
 
-def extract_data(tree, geometry_file):
+def parse_vertices(vertices):
+    ''' splits the "x,y;x,y;..." Vertices strings of the geometry xml in
+        one go, returns the (n, 2) vertices and the per-module offsets '''
+    vertices = list(vertices)
+    counts = np.fromiter((v.count(';') + 1 for v in vertices), dtype=np.int64, count=len(vertices))
+    flat = np.array(';'.join(vertices).replace(';', ',').split(','), dtype=np.float64)
+    return flat.reshape(-1, 2), np.concatenate(([0], np.cumsum(counts)))
+
+def split_ragged(values, offsets):
+    ''' flat array + offsets to one python list per module (hex_x/hex_y) '''
+    values, offsets = np.asarray(values, dtype=np.float64).tolist(), np.asarray(offsets).tolist()
+    return [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+class ModulePolygons:
+    ''' ragged module polygons (4 to 7 vertices each): all the vertices live
+        in one flat float32 (n, 2) buffer and offsets[i]:offsets[i+1] selects
+        the vertices of module i '''
+    def __init__(self, xy, offsets):
+        self.xy = np.asarray(xy, dtype=np.float32).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_vertices(cls, vertices):
+        return cls(*parse_vertices(vertices))
+
+    @classmethod
+    def from_shapely(cls, geometries):
+        ''' exterior rings of shapely polygons (closing vertex included) '''
+        coords, index = shapely.get_coordinates(shapely.get_exterior_ring(geometries), return_index=True)
+        counts = np.bincount(index, minlength=len(geometries))
+        return cls(coords, np.concatenate(([0], np.cumsum(counts))))
+
+    @classmethod
+    def from_frame(cls, df):
+        ''' compatibility path from the hex_x/hex_y list columns '''
+        counts = df['hex_x'].map(len).to_numpy()
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        if len(df) == 0: return cls(np.empty((0, 2)), offsets)
+        xy = np.column_stack((np.concatenate(df['hex_x'].to_numpy()), np.concatenate(df['hex_y'].to_numpy())))
+        return cls(xy, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def take(self, indices):
+        ''' sub-selection of modules, given as positions or a boolean mask '''
+        indices = np.arange(len(self))[indices]
+        counts = self.counts()[indices]
+        starts = np.repeat(self.offsets[indices], counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return ModulePolygons(self.xy[starts + local], np.concatenate(([0], np.cumsum(counts))))
+
+    def _reduce(self, ufunc, values):
+        return ufunc.reduceat(values, self.offsets[:-1]) if len(self) else np.empty(0, dtype=values.dtype)
+
+    def centroid(self):
+        ''' vertex average, the (x0, y0) used for labels and phi '''
+        xy = self.xy.astype(np.float64)
+        return np.column_stack((self._reduce(np.add, xy[:, 0]), self._reduce(np.add, xy[:, 1]))) / self.counts()[:, None]
+
+    def phi(self):
+        x0, y0 = self.centroid().T
+        return np.arctan2(y0, x0)
+
+    def bounding_radius(self):
+        ''' distance from the beam axis of the furthest vertex '''
+        return self._reduce(np.maximum, np.hypot(self.xy[:, 0], self.xy[:, 1]).astype(np.float64))
+
+    def bounds(self):
+        ''' (xmin, ymin, xmax, ymax) per module '''
+        x, y = self.xy[:, 0], self.xy[:, 1]
+        return np.column_stack((self._reduce(np.minimum, x), self._reduce(np.minimum, y),
+                                self._reduce(np.maximum, x), self._reduce(np.maximum, y)))
+
+    def area(self):
+        ''' shoelace formula, each vertex paired with the next one of its own polygon '''
+        following = np.arange(1, len(self.xy) + 1)
+        following[self.offsets[1:] - 1] = self.offsets[:-1]
+        x, y = self.xy[:, 0].astype(np.float64), self.xy[:, 1].astype(np.float64)
+        return 0.5 * np.abs(self._reduce(np.add, x * y[following] - x[following] * y))
+
+    def without_padding(self):
+        ''' drops the (0, 0) vertex padding 5-vertex modules to 6 vertices '''
+        counts = self.counts()
+        padded = (counts == 6) & (self.xy[np.maximum(self.offsets[1:] - 1, 0), 0] == 0.0)
+        keep = np.ones(len(self.xy), dtype=bool)
+        keep[self.offsets[1:][padded] - 1] = False
+        return ModulePolygons(self.xy[keep], np.concatenate(([0], np.cumsum(counts - padded)))), padded
+
+    def paths(self):
+        ''' closed outlines of all the modules in two flat arrays, separated by
+            NaN gaps, as expected by a single plotly 'toself' scatter trace '''
+        counts = self.counts()
+        starts = np.concatenate(([0], np.cumsum(counts + 2)))[:-1]
+        x = np.full(len(self.xy) + 2*len(self), np.nan)
+        y = np.full(len(self.xy) + 2*len(self), np.nan)
+        vertex_slots = np.repeat(starts - self.offsets[:-1], counts) + np.arange(len(self.xy))
+        x[vertex_slots], y[vertex_slots] = self.xy[:, 0], self.xy[:, 1]
+        x[starts + counts], y[starts + counts] = self.xy[self.offsets[:-1], 0], self.xy[self.offsets[:-1], 1]
+        return x, y
+
+    def to_shapely(self):
+        rings = shapely.linearrings(self.xy.astype(np.float64), indices=np.repeat(np.arange(len(self)), self.counts()))
+        return shapely.polygons(rings)
+
+    def hex_x(self):
+        return split_ragged(self.xy[:, 0], self.offsets)
+
+    def hex_y(self):
+        return split_ragged(self.xy[:, 1], self.offsets)
+
+class FrameColumns:
+    ''' growable columnar buffer for the frames of a channel allocation xml:
+        int16 index/column/frame and integer codes for the string ids '''
+    def __init__(self, key, capacity=4096):
+        self.key = key
+        self.size = 0
+        self.key_ids = {}
+        self.arrays = {name: np.empty(capacity, dtype=np.int16) for name in ('idx', 'Column', 'Frame')}
+        self.arrays.update({name: np.empty(capacity, dtype=np.int32) for name in (key, 'S1', 'Channel')})
+
+    def append(self, key, frame, s1, channel):
+        if self.size == len(self.arrays['Frame']):
+            for name, array in self.arrays.items():
+                self.arrays[name] = np.resize(array, 2*len(array))
+
+        i = self.size
+        self.arrays[self.key][i] = self.key_ids.setdefault(key, len(self.key_ids))
+        self.arrays['idx'][i]    = int(frame.get('index'))
+        self.arrays['Column'][i] = int(frame.get('column'))
+        self.arrays['Frame'][i]  = int(frame.get('id'))
+        self.arrays['S1'][i]      = s1
+        self.arrays['Channel'][i] = channel
+        self.size += 1
+
+    def to_dataframe(self, s1_ids, channel_ids):
+        categories = {self.key: list(self.key_ids), 'S1': list(s1_ids), 'Channel': list(channel_ids)}
+        columns = {}
+        for name in (self.key, 'idx', 'Column', 'Frame', 'S1', 'Channel'):
+            array = self.arrays[name][:self.size]
+            columns[name] = pd.Categorical.from_codes(array, categories[name]) if name in categories else array
+        return pd.DataFrame(columns)
+
+@xml_cache.cached('allocation')
+def read_channel_allocation(xml_file):
+    ''' streams the S1 => Channel => Frame hierarchy of a channel allocation
+        (or S1toChannels) xml, clearing the elements as soon as they are read.
+        Returns the raw frames: silicon ones per Module, scintillator ones per MB '''
+    if isinstance(xml_file, ET.ElementTree):
+        xml_file = io.BytesIO(ET.tostring(xml_file.getroot()))
+
+    s1_ids, channel_ids = {}, {}
+    frames = {'si': FrameColumns('Module'), 'sci': FrameColumns('MB')}
+    s1 = channel = None
+
+    context = ET.iterparse(xml_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'start':
+            if elem.tag == 'S1':        s1 = s1_ids.setdefault(elem.get('id'), len(s1_ids))
+            elif elem.tag == 'Channel': channel = channel_ids.setdefault(elem.get('id'), len(channel_ids))
+            continue
+
+        if elem.tag == 'Frame':
+            module = elem.get('Module')
+            MB = elem.get('Motherboard')
+            if module: frames['si'].append(module, elem, s1, channel)
+            elif MB:   frames['sci'].append(MB, elem, s1, channel)
+        elif elem.tag == 'S1':
+            root.clear()
+            continue
+        elem.clear()
+
+    return {det: frames[det].to_dataframe(s1_ids, channel_ids) for det in frames}
+
+def extract_data(xml_file, geometry_file):
     ''' takes data from the xml and adds some useful information
         like the module id and cartesian coords and phi '''
     
-    root = tree.getroot()
-    data_list_si = []
-    data_list_sci = []
-
     # reading the xml configuration file
-    for s1 in root.findall('.//S1'):
-        for channel in s1.findall('.//Channel'):
-            for frame in channel.findall('.//Frame'):
-                module = frame.get('Module')
-                MB = frame.get('Motherboard')
-                if module:
-                    data_list_si.append({
-                        'Module' : frame.get('Module'),
-                        'idx'    : int(frame.get('index')),
-                        'Column' : int(frame.get('column')),
-                        'Frame'  : int(frame.get('id')),
-                        'S1'     : s1.get('id'),
-                        'Channel': channel.get('id'),
-                    })
-                elif MB:
-                    data_list_sci.append({
-                        'MB'     : frame.get('Motherboard'),
-                        'idx'    : int(frame.get('index')),
-                        'Column' : int(frame.get('column')),
-                        'Frame'  : int(frame.get('id')),
-                        'S1'     : s1.get('id'),
-                        'Channel': channel.get('id'),
-                    })
-                else:
-                    continue 
+    frames = read_channel_allocation(xml_file)
 
     # adding additional information using geometry xml
     geometry = extract_module_info_from_xml(geometry_file)
-  
-    df_si  = pd.merge(pd.DataFrame(data_list_si),  geometry, on='Module', how='inner')
-    df_sci = pd.merge(pd.DataFrame(data_list_sci), geometry.drop_duplicates('MB'), on='MB', how='inner')
-    
-    df = {}
-    df['si'], df['sci'] = df_si, df_sci
+    df = join_geometry(frames, geometry)
     
     #df['phi'] = phi_calculator(df)
     return df
 
+@profiling.profiled('merge.geometry')
+def join_geometry(frames, geometry):
+    ''' joins the raw frames of read_channel_allocation with the geometry,
+        on the integer module / motherboard ids '''
+    frames = {det: frames[det].copy() for det in frames}
+    frames['si']['Module_id'] = hgcal_ids.encode(frames['si']['Module'])
+    frames['sci']['MB_id'] = hgcal_ids.encode(frames['sci']['MB'])
+  
+    df_si  = pd.merge(frames['si'].drop(columns='Module'),  geometry, on='Module_id', how='inner')
+    df_sci = pd.merge(frames['sci'].drop(columns='MB'), geometry.drop_duplicates('MB_id'), on='MB_id', how='inner')
+    df_si  = df_si[list(frames['si'].columns)  + [c for c in df_si.columns  if c not in frames['si']]]
+    df_sci = df_sci[list(frames['sci'].columns) + [c for c in df_sci.columns if c not in frames['sci']]]
+    return {'si': df_si, 'sci': df_sci}
+
 def create_slices(radius, total_angle_degrees=120, offset=0):
     central_angle_degrees = total_angle_degrees / 84
     x_coordinates = []
@@ -154,11 +328,7 @@ def get_MB_ids(regions, region):
 
 def extract_MB_plane_from_MBid(id):
     id_int = int(id, 16) # hexadecimal 'id' to integer
-
-    MotherboardId = id_int & 0x1FFF  # binary: 0001 1111 1111 1111
-    PlaneId = (id_int >> 13) & 0xFFFF
-
-    return MotherboardId, PlaneId
+    return hgcal_ids.motherboard_fields(id_int)
 
 def colorscale(df, variable, scale):
     #norm_points = (df[variable]-df[variable].min())/(0.1+df[variable].max()-df[variable].min())
@@ -167,14 +337,26 @@ def colorscale(df, variable, scale):
     colorscale = ['rgb(255, 255, 255)' if value == 'rgb(48, 18, 59)' else value for value in colorscale]
     return colorscale
 
-def plot_modules(df, variable):
+@profiling.profiled('figure.traces')
+def plot_modules(df, variable, batched=False, highlight=None, polygons=None):
+    ''' one scatter trace and one annotation per module or, with batched,
+        one trace per fill colour and a single text trace for the labels.
+        For a column, highlight can give the modules mask directly and the
+        batched mode does not modify df (polygons can be precomputed) '''
     if isinstance(variable, str):
         opacity = 1
-        df['Color'] = colorscale(df, variable, 'Viridis' if variable == 'trigLinks' else 'Turbo')
-        array_data = df[['hex_x', 'hex_y', 'x0', 'y0', 'Color', 'u', 'v', 'MB', 'TriggerLpGbts']].to_numpy()
+        colors = colorscale(df, variable, 'Viridis' if variable == 'trigLinks' else 'Turbo')
     else:
         opacity = 0.4
-        df['Color'] = ['rgb(0, 0, 255)' if value==variable else 'rgb(255, 255, 255)' for value in df['Column']]
+        highlight = df['Column'].to_numpy() == variable if highlight is None else highlight
+        colors = np.where(highlight, 'rgb(0, 0, 255)', 'rgb(255, 255, 255)')
+
+    if batched: return plot_modules_batched(df, variable, opacity, np.asarray(colors), polygons)
+
+    df['Color'] = colors
+    if isinstance(variable, str):
+        array_data = df[['hex_x', 'hex_y', 'x0', 'y0', 'Color', 'u', 'v', 'MB', 'TriggerLpGbts']].to_numpy()
+    else:
         array_data = df[['hex_x', 'hex_y', 'x0', 'y0', 'Color', 'u', 'v', 'MB']].to_numpy()
     
     listmodule = []
@@ -195,7 +377,32 @@ def plot_modules(df, variable):
     
     return listmodule, annotations
 
-def set_figure(scatter, annotations, local_plane, section='0'):
+def plot_modules_batched(df, variable, opacity, color_array, polygons=None):
+    polygons, padded = (ModulePolygons.from_frame(df) if polygons is None else polygons).without_padding()
+
+    coord = '(' + df['u'].astype(str) + ',' + df['v'].astype(str) + ')'
+    hover = (coord + '<br>' + ' MB: ' + df['MB'].astype(str)).to_numpy()
+    if isinstance(variable, str):
+        labels = 'MB:' + df['MB'].astype(str) + '<br>' + 'lpGBT:' + df['TriggerLpGbts'].astype(float).astype(int).astype(str)
+    else:
+        labels = hover
+    label_x = np.where(padded, polygons.centroid()[:, 0], df['x0'])
+    label_y = np.where(padded, polygons.centroid()[:, 1], df['y0'])
+
+    traces = []
+    for color in pd.unique(color_array):
+        selected = color_array == color
+        x, y = np.round(polygons.take(selected).paths(), 3)
+        traces.append(go.Scatter(x=x, y=y, mode="lines", fill='toself', fillcolor=color, opacity=opacity,
+                                 line_color='black', marker_line_color="black", hoverinfo='skip'))
+
+    # labels are not clipped, as the annotations they replace, and carry the module hover text
+    traces.append(go.Scatter(x=label_x, y=label_y, mode='text', text=np.asarray(labels), textfont=dict(color='black'),
+                             hovertext=hover, hoverinfo='text', showlegend=False, cliponaxis=False))
+    return traces, []
+
+@profiling.profiled('figure.build')
+def set_figure(scatter, annotations, local_plane, section='0', fingerprint=None):
     layer = local_plane if section == '0' else (str(int(local_plane) + 27) if section == '1' else '999')
     fig = go.Figure(scatter)
     fig.update_layout(width=800, height=900)
@@ -203,15 +410,22 @@ def set_figure(scatter, annotations, local_plane, section='0'):
     fig.update_layout(annotations=annotations, showlegend=False,
                  title='Display layer '+layer)
     
-    fig.write_image("layer"+layer+"_MB_60sector.pdf")
-    fig.write_image("layer"+str(layer)+"_MB_60sector.png")
+    rendering.write_figure(fig, "layer"+layer+"_MB_60sector", fingerprint=fingerprint)
+
+def extract_module_info_from_xml(xml_file, return_polygons=False):
+    ''' geometry is read from xml geometry file (or from its cache). With
+        return_polygons the columnar ModulePolygons (same row order) is
+        returned too '''
+    df = parse_geometry_xml(xml_file)
+    return (df, ModulePolygons.from_frame(df)) if return_polygons else df
 
-def extract_module_info_from_xml(xml_file):
-    ''' geometry is read from xml geometry file '''
+@xml_cache.cached('geometry', version=5)
+def parse_geometry_xml(xml_file):
     tree = ET.parse(xml_file)
     root = tree.getroot()
 
     data_list = []
+    vertices = []
     for plane in root.findall(".//Plane"):
         plane_id = int(plane.get('id'))
         if plane_id%2==0 and plane_id < 27: continue
@@ -223,55 +437,97 @@ def extract_module_info_from_xml(xml_file):
                     'MB'    : motherboard.get('id'), #extract_MB_plane_from_MBid(motherboard.get('id'))[0],
                     'u'     : int(module.get('u')),
                     'v'     : int(module.get('v')),
-                    'hex_x' : list(float(x.split(',')[0]) for x in module.get('Vertices').split(';')),
-                    'hex_y' : list(float(x.split(',')[1]) for x in module.get('Vertices').split(';')),
+                    'TCcount' : int(module.get('TCcount')) if module.get('TCcount', 'None') != 'None' else 0,
+                    'DaqRate' : float(module.get('DaqRate')),
                     'TriggerLpGbts' : motherboard.get('TriggerLpGbts'),
+                    'MB_TCcount' : int(motherboard.get('TCcount')) if motherboard.get('TCcount', 'None') != 'None' else 0,
                 })
+                vertices.append(module.get('Vertices'))
 
     df = pd.DataFrame(data_list)
+    df['Module_id'] = hgcal_ids.encode(df['Module'])
+    df['MB_id'] = hgcal_ids.encode(df['MB'])
+
+    # all the vertices are parsed at once, hex_x/hex_y are kept for compatibility
+    xy, offsets = parse_vertices(vertices)
+    polygons = ModulePolygons(xy, offsets)
+    df['hex_x'] = split_ragged(xy[:, 0], offsets)
+    df['hex_y'] = split_ragged(xy[:, 1], offsets)
+    df['x0'], df['y0'] = polygons.centroid().T
+    df['phi'] = polygons.phi()
     return df
 
+@xml_cache.cached('regions60')
 def extract_60regions_MB_from_xml(xml_file):
     tree = ET.parse(xml_file)
     root = tree.getroot()
 
-    regions = []
-    for region_elem in root.findall(".//Region"):
-        section = region_elem.get("section")
-        local_plane = region_elem.get("plane")
-        regions.append({
-            'section': region_elem.get("section"),
-            'plane'  : int(local_plane) if section == '0' else (int(local_plane) + 27 if section == '1' else 999),
-            'lr'     : region_elem.get("lr"),
-            'MB'     : region_elem.get("Motherboards")
-        })
-
-    df = pd.DataFrame(regions)
-    df['MB'] = df['MB'].str.split(';')
-    df = df.explode('MB', ignore_index=True)
-    df['MB'] = df['MB'].apply(extract_MB_plane_from_MBid).apply(lambda x: x[0])
-    return df
-
-def prepare_geometry_txt():
-    ''' old but working version, it reads the geometry 
-        file from Pedro's txt '''
-    geometry_file = 'geometries/v15.3/geometry.15.3.txt'
-    geometry_df = pd.read_csv(geometry_file,sep=' ')
-
-    geometry_df['hex_x'] = geometry_df[['vx_0','vx_1','vx_2','vx_3','vx_4','vx_5']].apply(list, axis=1)
-    geometry_df['hex_y'] = geometry_df[['vy_0','vy_1','vy_2','vy_3','vy_4','vy_5']].apply(list, axis=1)
-    
-    return geometry_df[['plane','u','v','MB','x0','y0','hex_x','hex_y','trigLinks']]
-
-def save_figure(fig, layer, args):
+    regions = pd.DataFrame([(region_elem.get("section"), region_elem.get("plane"), region_elem.get("lr"), region_elem.get("Motherboards"))
+                            for region_elem in root.findall(".//Region")], columns=['section', 'plane', 'lr', 'MB'])
+    local_plane = regions['plane'].astype(int).to_numpy()
+    section = regions['section'].to_numpy()
+    plane = np.where(section == '0', local_plane, np.where(section == '1', local_plane + 27, 999))
+
+    # one row per motherboard, all the ids decoded at once
+    MB_ids, region = hgcal_ids.split_lists(regions['MB'])
+    return pd.DataFrame({
+        'section': section[region],
+        'plane'  : plane[region],
+        'lr'     : regions['lr'].to_numpy()[region],
+        'MB'     : hgcal_ids.decode_motherboards(MB_ids)['MB'].astype(np.int64)
+    })
+
+GEOMETRY_TXT = 'geometries/v15.3/geometry.15.3.txt'
+TXT_MAX_VERTICES = 7
+TXT_DTYPES = {'plane': np.int16, 'u': np.int16, 'v': np.int16, 'MB': np.int32, 'x0': np.float64, 'y0': np.float64,
+              'trigLinks': np.float64, 'nvertices': np.int8, 'HDorLD': np.int8, 'dataRate_ld': np.float64,
+              'dataRate_hd': np.float64, 'isSiPM': np.int8}
+TXT_DTYPES.update({'v%s_%d' % (axis, k): np.float64 for k in range(TXT_MAX_VERTICES) for axis in 'xy'})
+
+@profiling.profiled('txt.geometry')
+def read_geometry_txt(txt_file=GEOMETRY_TXT):
+    ''' reads only the needed columns of Pedro's txt geometry (tab separated
+        as geometry.15.3.txt or space separated as geometry.hgcal.txt).
+        Returns the module table and the (n, 7, 2) vertices, of which only
+        the first nvertices are valid (the next one closes the outline).
+        DaqRate is the hd or ld data rate, as in the xml, and files without
+        isSiPM only have silicon modules '''
+    with open(txt_file) as f:
+        sep = '\t' if '\t' in f.readline() else r'\s+'
+    df = pd.read_csv(txt_file, sep=sep, usecols=lambda column: column in TXT_DTYPES, dtype=TXT_DTYPES)
+    vertices = np.stack([df[['vx_%d' % k for k in range(TXT_MAX_VERTICES)]].to_numpy(),
+                         df[['vy_%d' % k for k in range(TXT_MAX_VERTICES)]].to_numpy()], axis=-1)
+    df['DaqRate'] = np.where(df['HDorLD'] == 1, df['dataRate_hd'], df['dataRate_ld'])
+    df['scintillator'] = df['isSiPM'].astype(bool) if 'isSiPM' in df else False
+    df = df[['plane', 'u', 'v', 'MB', 'x0', 'y0', 'trigLinks', 'DaqRate', 'scintillator', 'nvertices']]
+    df['trigLinks'] = df['trigLinks'].astype(np.int16)
+    return df, vertices
+
+def prepare_geometry_txt(txt_file=GEOMETRY_TXT, return_polygons=False):
+    ''' geometry from Pedro's txt, with the Module/Module_id and hex_x/hex_y
+        columns of the xml loader (outline not closed, padding vertices
+        dropped). With return_polygons the ModulePolygons (same row order)
+        is returned too '''
+    df, vertices = read_geometry_txt(txt_file)
+    df['Module_id'] = hgcal_ids.module_ids(df['plane'], df['u'], df['v'], df['scintillator'])
+    df['Module'] = ['0x%08X' % module for module in df['Module_id']]
+    counts = df['nvertices'].to_numpy()
+    xy = vertices[np.arange(TXT_MAX_VERTICES) < counts[:, None]]
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    polygons = ModulePolygons(xy, offsets)
+    df['hex_x'] = split_ragged(xy[:, 0], offsets)
+    df['hex_y'] = split_ragged(xy[:, 1], offsets)
+    df = df[['plane','Module','Module_id','u','v','MB','x0','y0','hex_x','hex_y','trigLinks','DaqRate','scintillator']]
+    return (df, polygons) if return_polygons else df
+
+def save_figure(fig, layer, args, fingerprint=None):
     if args.channel: title = "S1toChannels_channel_layer_"+str(layer)
     if args.module:  title = "S1toChannels_module_layer_" +str(layer)
     if args.frame:   title = "S1toChannels_frame_layer_"  +str(layer)
     title += "_sector60" if args.sector60 else "_sector120"
     title += "_phi" if args.phi else ""
 
-    fig.write_image(title+".pdf")
-    fig.write_image(title+".png")
+    rendering.write_figure(fig, title, fingerprint=fingerprint)
     
 def save_csv(df, layer, args):
     df = df.sort_values(by=['Module','Module_idx']).drop_duplicates(['Module'], 'last')
@@ -0,0 +1,183 @@
+''' module adjacency of every layer and the traffic on the boundaries of
+    the regions and S1 FPGAs. Two modules of a plane are neighbours if they
+    are next to each other on the (u, v) lattice of the silicon modules or,
+    for the scintillator tiles (not on the lattice), if their outlines share
+    an edge, the gaps between modules being bridged by a tolerance. The graph
+    of the whole detector is kept in CSR form over the geometry rows: the
+    neighbours of module i are indices[indptr[i]:indptr[i+1]], always in the
+    same plane.
+
+    Boundary modules have a neighbour with another label (region, S1...),
+    their trigger cells are the ones duplicated into the neighbouring S2
+    columns. All the statistics come from one pass over the edges.
+
+    python adjacency.py --output boundaries
+    python adjacency.py --geometry xml/Geometry_old.xml --regions60 xml/Regions.60.NoSplit.xml '''
+
+import argparse
+import numpy as np
+import pandas as pd
+import shapely
+
+import Tools as tools
+import hgcal_ids
+import hierarchy
+import geometry_diff
+import mapping
+import profiling
+
+LATTICE_NEIGHBOURS = np.array([(1, 0), (0, 1), (1, 1)])  # the other 3 are the reverse edges
+
+class ModuleGraph:
+    ''' undirected graph over the rows of a geometry, in CSR form '''
+    def __init__(self, indptr, indices):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    @classmethod
+    def from_edges(cls, n, i, j):
+        ''' from the (i, j) pairs, each edge given once in either direction '''
+        source, target = np.concatenate((i, j)), np.concatenate((j, i))
+        order = np.lexsort((target, source))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(source, minlength=n))))
+        return cls(indptr, target[order])
+
+    @classmethod
+    @profiling.profiled('adjacency.build')
+    def build(cls, geometry, polygons, tolerance=5., min_shared=10.):
+        ''' lattice neighbours of the silicon modules plus the scintillator
+            tiles sharing at least min_shared mm of outline with a module,
+            gaps up to tolerance mm '''
+        hgcal_ids.reject_replicas(geometry['Module_id'], 'ModuleGraph')
+        polygons, _ = polygons.without_padding()
+        shapes = polygons.to_shapely()
+        plane = geometry['plane'].to_numpy()
+        scintillator = geometry_diff._scintillator(geometry['Module'])
+
+        # (u, v) lattice: the (plane, u, v) keys of the 3 forward neighbours,
+        # from the geometry columns (any id scheme)
+        silicon = np.flatnonzero(~scintillator)
+        u, v = geometry['u'].to_numpy()[silicon], geometry['v'].to_numpy()[silicon]
+        keys = pd.Index(geometry_diff.module_keys(plane[silicon], u, v, False))
+        found = keys.get_indexer(geometry_diff.module_keys(plane[silicon][:, None], u[:, None] + LATTICE_NEIGHBOURS[:, 0],
+                                                           v[:, None] + LATTICE_NEIGHBOURS[:, 1], False).ravel())
+        lattice_i = np.repeat(silicon, len(LATTICE_NEIGHBOURS))[found >= 0]
+        lattice_j = silicon[found[found >= 0]]
+
+        # shared outlines, for the candidate pairs of the same plane with a tile
+        i, j = shapely.STRtree(shapes).query(shapes[scintillator], predicate='dwithin', distance=tolerance)
+        i = np.flatnonzero(scintillator)[i]
+        keep = (i != j) & (plane[i] == plane[j])
+        i, j = i[keep], j[keep]
+        shared = shapely.length(shapely.intersection(shapely.boundary(shapes[j]), shapely.buffer(shapes[i], tolerance)))
+        i, j = i[shared >= min_shared], j[shared >= min_shared]
+
+        pairs = np.column_stack((np.concatenate((lattice_i, i)), np.concatenate((lattice_j, j))))
+        pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+        return cls.from_edges(len(geometry), pairs[:, 0], pairs[:, 1])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbours(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def edges(self):
+        ''' (source, target) of both directions of every edge '''
+        return np.repeat(np.arange(len(self)), self.degree()), self.indices
+
+def module_TCs(geometry):
+    ''' trigger cells of each module; the scintillator TCs, only known per
+        motherboard, are shared evenly by its tiles '''
+    TCs = geometry['TCcount'].to_numpy().astype(np.float64)
+    scintillator = geometry_diff._scintillator(geometry['Module'])
+    MB = geometry['MB'].to_numpy()
+    silicon_TCs = pd.Series(TCs).groupby(MB).transform('sum').to_numpy()
+    tiles = pd.Series(scintillator).groupby(MB).transform('sum').to_numpy()
+    return np.where(scintillator, (geometry['MB_TCcount'].to_numpy() - silicon_TCs) / np.maximum(tiles, 1), TCs)
+
+def module_labels(geometry, S1_file=mapping.S1_FILE, regions_file=mapping.REGIONS_FILE, geometry_file=mapping.GEOMETRY_FILE):
+    ''' Region and S1 of each geometry row, through the hierarchy of the
+        120 degree regions (read_regions_xml_file), '' if not read out '''
+    modules = hierarchy.load_hierarchy(S1_file, regions_file, geometry_file).module_table().set_index('Module')
+    labels = modules.reindex(geometry['Module'])[['Region', 'S1']].fillna('')
+    return labels.reset_index(drop=True)
+
+def regions60_labels(geometry, regions60):
+    ''' 60 degree region (section/plane/lr) of each row of a geometry with the
+        old motherboard ids, from Tools.extract_60regions_MB_from_xml; ''
+        for the Geometry.xml ids (0x6...), which do not encode the MB number '''
+    MB_ids = hgcal_ids.encode(geometry['MB'])
+    MB_number, _ = hgcal_ids.motherboard_fields(MB_ids)
+    MB_number = np.where(((MB_ids & 0xFFFFFFFF) >> 28) == 6, -1, MB_number)
+    regions60 = regions60.drop_duplicates(['plane', 'MB'])
+    region = regions60['section'].astype(str) + '/' + regions60['plane'].astype(str) + '/' + regions60['lr'].astype(str)
+    lookup = pd.Series(region.to_numpy(), index=pd.MultiIndex.from_frame(regions60[['plane', 'MB']]))
+    return lookup.reindex(pd.MultiIndex.from_arrays([geometry['plane'].to_numpy(), MB_number])).fillna('').to_numpy()
+
+def boundary_modules(graph, labels):
+    ''' per module, the number of neighbours with another (non empty) label '''
+    source, target = graph.edges()
+    labels = np.asarray(labels)
+    crossing = (labels[source] != labels[target]) & (labels[source] != '') & (labels[target] != '')
+    return np.bincount(source[crossing], minlength=len(graph))
+
+def boundary_stats(graph, labels, TCs, plane=None):
+    ''' per label (and plane if given): modules, TCs, the modules and TCs on
+        its boundary, the edges leaving it and the number of labels it borders '''
+    source, target = graph.edges()
+    labels = pd.Series(labels, dtype=str).to_numpy()
+    crossing = (labels[source] != labels[target]) & (labels[source] != '') & (labels[target] != '')
+    on_boundary = np.bincount(source[crossing], minlength=len(graph)) > 0
+
+    keys = ['label'] if plane is None else ['label', 'plane']
+    modules = pd.DataFrame({'label': labels, 'TCs': TCs, 'boundary': on_boundary})
+    if plane is not None: modules['plane'] = plane
+    modules = modules[modules['label'] != '']
+    modules['boundary_TCs'] = np.where(modules['boundary'], modules['TCs'], 0.)
+
+    stats = modules.groupby(keys).agg(modules=('TCs', 'size'), TCs=('TCs', 'sum'),
+                                      boundary_modules=('boundary', 'sum'), boundary_TCs=('boundary_TCs', 'sum'))
+    edges = pd.DataFrame({'label': labels[source[crossing]], 'neighbour': labels[target[crossing]]})
+    if plane is not None: edges['plane'] = np.asarray(plane)[source[crossing]]
+    stats['boundary_edges'] = edges.groupby(keys).size()
+    stats['neighbours'] = edges.drop_duplicates(keys + ['neighbour']).groupby(keys).size()
+    stats = stats.fillna(0)
+    stats['boundary_fraction'] = stats['boundary_TCs'] / stats['TCs'].where(stats['TCs'] > 0)
+    return stats.astype({'boundary_modules': np.int64, 'boundary_edges': np.int64, 'neighbours': np.int64}).round(3)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modules and TCs on the boundaries of the regions and S1 FPGAs.")
+    parser.add_argument("--geometry", default=mapping.GEOMETRY_FILE, help="Geometry xml file")
+    parser.add_argument("--regions",  default=mapping.REGIONS_FILE, help="Regions xml file (120 degree)")
+    parser.add_argument("--S1",       default=mapping.S1_FILE, help="S1 xml file")
+    parser.add_argument("--regions60", default=None, help="Also the 60 degree regions (xml/Regions.60.NoSplit.xml), with --geometry xml/Geometry_old.xml")
+    parser.add_argument("--tolerance", type=float, default=5., help="Gap [mm] between the outlines of neighbouring modules")
+    parser.add_argument("--output",   default=None, help="Save the tables as <output>_regions.csv, <output>_S1.csv, <output>_layers.csv (and _regions60.csv)")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    geometry, polygons = tools.extract_module_info_from_xml(args.geometry, return_polygons=True)
+    graph = ModuleGraph.build(geometry, polygons, args.tolerance)
+    labels = module_labels(geometry, args.S1, args.regions, args.geometry)
+    TCs = module_TCs(geometry)
+
+    tables = {'regions': boundary_stats(graph, labels['Region'], TCs),
+              'S1'     : boundary_stats(graph, labels['S1'], TCs),
+              'layers' : boundary_stats(graph, labels['S1'], TCs, geometry['plane'].to_numpy()).groupby('plane').sum(numeric_only=True)}
+    tables['layers']['boundary_fraction'] = (tables['layers']['boundary_TCs'] / tables['layers']['TCs']).round(3)
+    if args.regions60:
+        regions60 = regions60_labels(geometry, tools.extract_60regions_MB_from_xml(args.regions60))
+        if not (regions60 != '').any(): parser.error("no module of %s is in a 60 degree region (old motherboard ids needed)" % args.geometry)
+        tables['regions60'] = boundary_stats(graph, regions60, TCs)
+
+    print(f"{len(graph)} modules, {graph.degree().sum() // 2} edges, mean degree {graph.degree().mean():.2f}")
+    with pd.option_context('display.width', 200, 'display.max_rows', 100):
+        for name, table in tables.items():
+            print(f"\nper {name}:")
+            print(table)
+            if args.output: table.to_csv(f"{args.output}_{name}.csv")
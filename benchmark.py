@@ -0,0 +1,158 @@
+''' timing of the hot paths of the pipeline: xml parsing, merges, figure
+    construction, slice geometry, plotly serialization and (optionally)
+    image export. Each stage runs in its own forked process, after its
+    setup, and reports its wall time (best of --repeat), the peak RSS of
+    the process and the memory allocated by python (tracemalloc).
+    With --synthetic the inputs are replicated to the full detector.
+
+    python benchmark.py --output bench.json '''
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import platform
+import argparse
+import resource
+import subprocess
+import tracemalloc
+import multiprocessing
+
+import plotly.graph_objects as go
+
+import Tools as tools
+import columns
+import synthetic
+
+GEOMETRY_FILE = 'xml/Geometry.xml'
+REGIONS60_FILE = 'xml/Regions.60.NoSplit.xml'
+ALLOCATION_FILES = [
+    'xml/ChannelAllocation_SeparateTD-120-MixedTypes-NoSplit.xml',
+    'xml/S1toChannels.SeparateTD.120.MixedTypes.NoSplit.xml',
+    'xml/S1toChannels.SeparateTD.120.SingleTypes.NoSplit.xml',
+    'xml/S1toChannels.SeparateTD.Identical60.SingleTypes.NoSplit.xml',
+]
+
+def _name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _uncached(loader):
+    ''' the loader without the xml cache '''
+    return getattr(loader, '__wrapped__', loader)
+
+def _layer_maps(geometry):
+    ''' batched traces of every layer, as FE_to_regions.py '''
+    return [tools.plot_modules(geometry[geometry.plane == plane].copy(), 'MB', batched=True) for plane in geometry.plane.unique()]
+
+def _layer_figures(geometry):
+    return [go.Figure(scatter).update_layout(annotations=annotations) for scatter, annotations in _layer_maps(geometry)]
+
+def _slice_pieces(geometry):
+    columns._column_pieces.cache_clear()
+    for plane in geometry.plane.unique():
+        polygons = tools.ModulePolygons.from_frame(geometry[geometry.plane == plane])
+        columns.module_column_pieces(polygons, polygons.bounds()[:, 2].max() + 300)
+
+def stages(geometry_file, allocation_files, export=False):
+    ''' name -> (setup, run): setup() is not timed, run(setup result) is '''
+    read_geometry = lambda: _uncached(tools.parse_geometry_xml)(geometry_file)
+    stages = {
+        'geometry_xml':    (lambda: geometry_file, _uncached(tools.parse_geometry_xml)),
+        'geometry_cached': (lambda: _warm_cache(geometry_file), tools.extract_module_info_from_xml),
+        'regions60_xml':   (lambda: REGIONS60_FILE, _uncached(tools.extract_60regions_MB_from_xml)),
+        'geometry_txt':    (lambda: None, lambda _: tools.prepare_geometry_txt()),
+    }
+    for allocation_file in allocation_files:
+        name = _name(allocation_file)
+        stages['allocation_xml/' + name] = (lambda f=allocation_file: f, _uncached(tools.read_channel_allocation))
+        stages['merge/' + name] = (lambda f=allocation_file: (_uncached(tools.read_channel_allocation)(f), read_geometry()),
+                                   lambda inputs: tools.join_geometry(*inputs))
+        stages['extract_data/' + name] = (lambda f=allocation_file: f, lambda f: _uncached_extract_data(f, geometry_file))
+    stages['plot_modules'] = (read_geometry, _layer_maps)
+    stages['figures'] = (read_geometry, _layer_figures)
+    stages['slice_geometry'] = (read_geometry, _slice_pieces)
+    stages['render_json'] = (lambda: _layer_figures(read_geometry()), lambda figures: [fig.to_json() for fig in figures])
+    if export:
+        stages['export_png'] = (lambda: _layer_figures(read_geometry())[:3], lambda figures: [fig.to_image(format='png') for fig in figures])
+    return stages
+
+def _warm_cache(geometry_file):
+    tools.extract_module_info_from_xml(geometry_file)
+    return geometry_file
+
+def _uncached_extract_data(allocation_file, geometry_file):
+    os.environ['HGCAL_XML_CACHE'] = '0'
+    return tools.extract_data(allocation_file, geometry_file)
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def _measure(setup, run, repeat, queue):
+    try:
+        state = setup()
+        rss_before = _max_rss_mb()
+        wall = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(state)
+            wall.append(time.perf_counter() - start)
+        rss_peak = _max_rss_mb()
+
+        # allocations are traced in a separate run, tracemalloc slows it down
+        tracemalloc.start()
+        run(state)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        queue.put({'wall_s': min(wall), 'wall_mean_s': sum(wall) / len(wall), 'peak_rss_mb': rss_peak,
+                   'rss_growth_mb': rss_peak - rss_before, 'alloc_peak_mb': peak / 2**20, 'alloc_retained_mb': current / 2**20})
+    except Exception as error:
+        queue.put({'error': type(error).__name__ + ': ' + str(error)})
+
+def run_stage(setup, run, repeat=3):
+    ''' measurements of one stage, in a forked process '''
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(setup, run, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def _git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the parse, merge and render stages.")
+    parser.add_argument("--geometry",   default=GEOMETRY_FILE, help="Geometry xml file")
+    parser.add_argument("--allocation", action="append", default=None, help="Allocation xml files (default: the shipped ones)")
+    parser.add_argument("--stages",     action="append", default=None, help="Only the stages matching these glob patterns")
+    parser.add_argument("--repeat",     type=int, default=3, help="Timed runs per stage, the best one is reported")
+    parser.add_argument("--export",     action="store_true", help="Also time the png export with kaleido")
+    parser.add_argument("--synthetic",  action="store_true", help="Replicate the inputs to the full detector (3 sectors x 2 endcaps)")
+    parser.add_argument("--copies",     type=int, default=synthetic.SECTORS*synthetic.ENDCAPS, help="Copies of the sector with --synthetic")
+    parser.add_argument("--synthetic_dir", default='synthetic', help="Folder of the synthetic inputs")
+    parser.add_argument("--output",     default=None, help="Save the results as json")
+    args = parser.parse_args()
+
+    geometry_file, allocation_files = args.geometry, args.allocation or ALLOCATION_FILES
+    if args.synthetic:
+        outputs = synthetic.full_detector(args.synthetic_dir, [geometry_file] + allocation_files, args.copies)
+        geometry_file, allocation_files = outputs[geometry_file], [outputs[f] for f in allocation_files]
+
+    results = []
+    for name, (setup, run) in stages(geometry_file, allocation_files, args.export).items():
+        if args.stages and not any(fnmatch.fnmatch(name, pattern) for pattern in args.stages): continue
+        result = dict(stage=name, **run_stage(setup, run, args.repeat))
+        results.append(result)
+        if 'error' in result: print(f"{name:<70} FAILED {result['error']}", file=sys.stderr)
+        else: print(f"{name:<70} {result['wall_s']:8.3f} s {result['peak_rss_mb']:8.1f} MB rss {result['alloc_peak_mb']:8.1f} MB alloc")
+
+    report = {'version': _git_version(), 'python': platform.python_version(), 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'inputs': {'geometry': geometry_file, 'allocations': allocation_files, 'synthetic': args.copies if args.synthetic else None},
+              'stages': results}
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=1)
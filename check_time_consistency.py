@@ -7,7 +7,10 @@ import plotly.io as pio
 pio.kaleido.scope.mathjax = None
 pd.options.plotting.backend = "plotly"
 
-import Tools as tools
+import rendering
+import mapping
+import dashboard
+import profiling
 
 def plotting_frames(df, variable):
     ''' generic plotting function to create different scatter
@@ -37,25 +40,36 @@ def create_scatter_plot(df, variable):
 
     df_split = {}
     for var in df[variable].unique():
-        df_split[var] = df[df[variable] == var].reset_index(drop=True)
-
-        fig = plotting_frames(df_split[var], var) 
         if args.fpga:    title = "Channel_allocation_device_" +str(var)
         if args.column:  title = "Channel_allocation_column_" +str(var)
-        fig.write_image(title+".pdf")
-        fig.write_image(title+".png")
+        df_split[var] = df[df[variable] == var].reset_index(drop=True)
+        inputs = rendering.fingerprint(df_split[var][['S1', 'Channel', 'Column', 'Frame']])
+        if not rendering.wanted(title, inputs): continue
+
+        with profiling.span(variable, value=var):
+            with profiling.span('figure.build'):
+                fig = plotting_frames(df_split[var], var) 
+            rendering.write_figure(fig, title, fingerprint=inputs)
 
 if __name__ == "__main__":
     ''' python check_time_consistency.py '''
     parser = argparse.ArgumentParser(description="A script that chooses between --channel and --module.")
     parser.add_argument("--fpga",     action="store_true", help="Create scatter plots phi vs columns. Each marker is a frame", default=True)
     parser.add_argument("--column", action="store_true", help="Create HGCAL maps per layer and per columns highliting modules selected")
+    parser.add_argument("--allocation", default='xml/S1toChannels.SeparateTD.Identical60.SingleTypes.NoSplit.xml', help="S1toChannels (or ChannelAllocation) xml file")
+    parser.add_argument("--geometry",   default='xml/Geometry.xml', help="Geometry xml file")
+    rendering.add_arguments(parser)
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.configure(args)
 
-    tree = ET.parse('xml/S1toChannels.SeparateTD.Identical60.SingleTypes.NoSplit.xml')
-    geometry_file = 'xml/Geometry.xml'
+    allocation_file = args.allocation
+    geometry_file = args.geometry
 
-    df = tools.extract_data(tree, geometry_file)
+    model = mapping.load_model(geometry_file=geometry_file, allocation_file=allocation_file)
+    df = model.allocation
     variable = 'Column' if args.column else 'S1'
-    create_scatter_plot(df, variable)
+    if args.html: dashboard.write_dashboard(model, args.html)
+    with rendering.pool(args):
+        create_scatter_plot(df, variable)
 
@@ -0,0 +1,149 @@
+''' geometry of the S2 processing columns: the 120 degree sector is split
+    in 84 phi columns (plus the negative ones at the lower edge), column i
+    covering phi in [i, i+1] * 120/84 degrees '''
+
+import math
+import hashlib
+import functools
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import Point
+
+import Tools as tools
+import xml_cache
+import profiling
+
+N_COLUMNS = 84
+SECTOR_DEGREES = 120
+FIRST_COLUMN = -10
+LAST_COLUMN = 84
+
+def column_of(x, y):
+    ''' column covering the phi of each (x, y) point '''
+    phi = np.degrees(np.arctan2(y, x))
+    return np.floor(phi / (SECTOR_DEGREES / N_COLUMNS)).astype(np.int64)
+
+@functools.lru_cache(maxsize=None)
+def column_sectors(radius, first=FIRST_COLUMN, last=LAST_COLUMN):
+    ''' one sector polygon per column, from first to last included '''
+    width = SECTOR_DEGREES / N_COLUMNS
+    center = Point(0, 0)
+    return np.array([tools.create_sector(center, math.radians(i*width), math.radians((i+1)*width), radius)
+                     for i in range(first, last + 1)], dtype=object)
+
+def polygons_key(polygons):
+    return hashlib.md5(polygons.xy.tobytes() + polygons.offsets.tobytes()).hexdigest()
+
+class _Keyed:
+    ''' polygons hashed by their coordinates, as an lru_cache argument '''
+    def __init__(self, polygons):
+        self.polygons = polygons
+        self.key = polygons_key(polygons)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+@profiling.profiled('geometry.column_pieces')
+def module_column_pieces(polygons, radius, first=FIRST_COLUMN, last=LAST_COLUMN):
+    ''' intersection of every module with every column it overlaps.
+        Only the (module, column) pairs selected by an STRtree query are
+        intersected, in one vectorized shapely call. Returns the module
+        positions in polygons, the columns and the polygonal pieces.
+        The result depends on the geometry only, the last ones are kept in memory '''
+    return _column_pieces(_Keyed(polygons), float(radius), first, last)
+
+@functools.lru_cache(maxsize=128)
+def _column_pieces(keyed, radius, first, last):
+    sectors = column_sectors(radius, first, last)
+    modules = keyed.polygons.to_shapely()
+    module_idx, sector_idx = shapely.STRtree(sectors).query(modules, predicate='intersects')
+    pieces = shapely.intersection(modules[module_idx], sectors[sector_idx])
+
+    # columns only touching a module give points or lines, they are dropped
+    parts, part_idx = shapely.get_parts(pieces, return_index=True)
+    polygonal = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+    module_idx, column = module_idx[part_idx][polygonal], sector_idx[part_idx][polygonal] + first
+    parts = parts[polygonal]
+
+    order = np.lexsort((column, module_idx))
+    return module_idx[order], column[order], parts[order]
+
+class ColumnOverlapIndex:
+    ''' which columns each module (or motherboard) overlaps, in CSR form:
+        the columns of keys[i] are columns[indptr[i]:indptr[i+1]] and
+        fraction holds the share of its area falling in each of them '''
+    def __init__(self, keys, indptr, columns, fraction, key='Module'):
+        self.key = key
+        self.keys = np.asarray(keys)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.columns = np.asarray(columns, dtype=np.int16)
+        self.fraction = np.asarray(fraction, dtype=np.float32)
+        self.positions = {k: i for i, k in enumerate(self.keys)}
+
+    @classmethod
+    def build(cls, geometry, key='Module', first=FIRST_COLUMN, last=LAST_COLUMN):
+        ''' geometry as returned by Tools.extract_module_info_from_xml '''
+        modules = geometry.drop_duplicates('Module').reset_index(drop=True)
+        polygons = tools.ModulePolygons.from_frame(modules)
+        radius = math.ceil(polygons.bounding_radius().max()) + 300
+        module_idx, column, pieces = module_column_pieces(polygons, radius, first, last)
+
+        areas = pd.DataFrame({key: modules[key].to_numpy()[module_idx], 'Column': column, 'area': shapely.area(pieces)})
+        areas = areas.groupby([key, 'Column'], sort=False)['area'].sum().reset_index()
+        total = pd.Series(polygons.area(), index=modules.index).groupby(modules[key]).sum()
+        areas['fraction'] = areas['area'] / total.reindex(areas[key]).to_numpy()
+        return cls.from_frame(areas, key, keys=total.index)
+
+    @classmethod
+    def from_frame(cls, df, key='Module', keys=None):
+        ''' from a (key, Column, fraction) table, keys without overlap are kept '''
+        keys = pd.Index(pd.unique(df[key]) if keys is None else keys)
+        df = df.assign(position=keys.get_indexer(df[key])).sort_values(['position', 'Column'])
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(df['position'], minlength=len(keys)))))
+        return cls(keys.to_numpy(), indptr, df['Column'].to_numpy(), df['fraction'].to_numpy(), key)
+
+    def to_frame(self):
+        return pd.DataFrame({self.key: np.repeat(self.keys, np.diff(self.indptr)),
+                             'Column': self.columns, 'fraction': self.fraction})
+
+    def columns_of(self, key):
+        ''' columns overlapped by a module/motherboard and the area fractions '''
+        i = self.positions[key]
+        return self.columns[self.indptr[i]:self.indptr[i+1]], self.fraction[self.indptr[i]:self.indptr[i+1]]
+
+    def n_columns(self):
+        return pd.Series(np.diff(self.indptr), index=self.keys, name='n_columns')
+
+    def join(self, frames):
+        ''' adds to the allocation frames the fraction of the module (or MB)
+            area inside the column the frame is sent to, 0 if none '''
+        overlap = self.to_frame().rename(columns={'fraction': 'overlap'})
+        frames = frames.astype({'Column': np.int16})
+        joined = pd.merge(frames, overlap, on=[self.key, 'Column'], how='left')
+        joined['overlap'] = joined['overlap'].fillna(0.)
+        return joined
+
+    def validate(self, frames):
+        ''' frames sent to a column their module (or MB) does not overlap '''
+        joined = self.join(frames)
+        return joined[joined['overlap'] == 0.]
+
+@xml_cache.cached('column_overlap', version=2)
+def _overlap_table(geometry_file):
+    ''' the overlaps and, as <key>_keys, all the keys (with or without overlap) '''
+    geometry = tools.extract_module_info_from_xml(geometry_file)
+    frames = {}
+    for key in ('Module', 'MB'):
+        index = ColumnOverlapIndex.build(geometry, key)
+        frames[key], frames[key + '_keys'] = index.to_frame(), pd.DataFrame({key: index.keys})
+    return frames
+
+def load_overlap_index(geometry_file='xml/Geometry.xml', key='Module'):
+    ''' overlap index built from the geometry xml (columns FIRST_COLUMN to
+        LAST_COLUMN), persisted next to it and rebuilt when it changes '''
+    tables = _overlap_table(geometry_file)
+    return ColumnOverlapIndex.from_frame(tables[key], key, keys=tables[key + '_keys'][key])
@@ -0,0 +1,213 @@
+''' one self-contained html dashboard per allocation scenario. The module
+    polygons, their (module, column) pieces and the frames are embedded
+    once as base64 typed arrays, the views (modules of a column, frames per
+    module x column, channel allocation of an S1 or of a column) are built
+    in the browser from them, with the layer/column/S1 selected there '''
+
+import html
+import json
+import base64
+import numpy as np
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+import Tools as tools
+import columns
+
+def _typed(array, dtype):
+    ''' {dtype, base64} of a little-endian numpy array '''
+    array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': np.dtype(dtype).name, 'data': base64.b64encode(array.tobytes()).decode('ascii')}
+
+def build_payload(model, title):
+    ''' arrays of the dashboard: modules (geometry), pieces (module x
+        column intersections) and frames (si and sci allocation) '''
+    geometry = model.geometry.drop_duplicates('Module_id').reset_index(drop=True)
+    polygons, _ = tools.ModulePolygons.from_frame(geometry).without_padding()
+    MB_names, MB_of_module = np.unique(geometry['MB'].to_numpy(dtype=str), return_inverse=True)
+
+    # pieces of every module in every column it overlaps, with the TCs it sends there
+    radius = polygons.bounds()[:, 2].max() + 300
+    piece_module, piece_column, pieces = columns.module_column_pieces(polygons, radius)
+    pieces = tools.ModulePolygons.from_shapely(pieces)
+
+    si, sci = model.frames['si'], model.frames['sci']
+    module_position = pd.Index(geometry['Module_id'])
+    frame_module = np.concatenate([module_position.get_indexer(si['Module_id']), np.full(len(sci), -1)])
+    frame_MB = np.concatenate([np.searchsorted(MB_names, si['MB'].to_numpy(dtype=str)),
+                               np.searchsorted(MB_names, sci['MB'].to_numpy(dtype=str))])
+    S1 = pd.Categorical(np.concatenate([si['S1'].to_numpy(dtype=str), sci['S1'].to_numpy(dtype=str)]))
+    channel = pd.Categorical(np.concatenate([si['Channel'].to_numpy(dtype=str), sci['Channel'].to_numpy(dtype=str)]))
+    frame_column = np.concatenate([si['Column'].to_numpy(), sci['Column'].to_numpy()])
+
+    TCs = pd.Series(1, index=pd.MultiIndex.from_arrays([frame_module, frame_column])).groupby(level=[0, 1]).size()
+    piece_TCs = TCs.reindex(pd.MultiIndex.from_arrays([piece_module, piece_column]), fill_value=0).to_numpy()
+
+    return {
+        'title': title,
+        'n_columns': columns.N_COLUMNS, 'sector': columns.SECTOR_DEGREES,
+        'first_column': columns.FIRST_COLUMN, 'last_column': columns.LAST_COLUMN,
+        'colors': {str(k): v for k, v in tools.colors.items()},
+        'modules': {
+            'names': geometry['Module'].tolist(), 'MBs': MB_names.tolist(),
+            'plane': _typed(geometry['plane'], np.int16), 'u': _typed(geometry['u'], np.int16), 'v': _typed(geometry['v'], np.int16),
+            'MB': _typed(MB_of_module, np.int32), 'x0': _typed(geometry['x0'], np.float32), 'y0': _typed(geometry['y0'], np.float32),
+            'xy': _typed(polygons.xy.ravel(), np.float32), 'offsets': _typed(polygons.offsets, np.int32),
+        },
+        'pieces': {
+            'module': _typed(piece_module, np.int32), 'column': _typed(piece_column, np.int16), 'TCs': _typed(piece_TCs, np.int16),
+            'xy': _typed(pieces.xy.ravel(), np.float32), 'offsets': _typed(pieces.offsets, np.int32),
+        },
+        'frames': {
+            'S1s': list(S1.categories), 'channels': list(channel.categories),
+            'module': _typed(frame_module, np.int32), 'MB': _typed(frame_MB, np.int32),
+            'S1': _typed(S1.codes, np.int16), 'channel': _typed(channel.codes, np.int16),
+            'column': _typed(frame_column, np.int16),
+            'frame': _typed(np.concatenate([si['Frame'].to_numpy(), sci['Frame'].to_numpy()]), np.int16),
+        },
+    }
+
+def write_dashboard(model, path, title=None):
+    ''' writes the dashboard of the model allocation scenario to path '''
+    title = title or model.allocation_file
+    # the payload is inlined in a <script>: no '</' may close it
+    payload = json.dumps(build_payload(model, title), separators=(',', ':')).replace('</', '<\\/')
+    with open(path, 'w') as f:
+        f.write(TEMPLATE.replace('__TITLE__', html.escape(title)).replace('__PLOTLYJS__', get_plotlyjs()).replace('__PAYLOAD__', payload))
+    print(f"dashboard written to {path}")
+
+TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<script>__PLOTLYJS__</script>
+<style>
+  body { font-family: sans-serif; margin: 10px; }
+  #controls > * { margin-right: 14px; }
+</style>
+</head>
+<body>
+<h3>__TITLE__</h3>
+<div id="controls">
+  <select id="view">
+    <option value="modules">Modules sending TCs to a column</option>
+    <option value="frames">TCs per module x column</option>
+    <option value="S1">Channel allocation of an S1</option>
+    <option value="column">Channel allocation of a column</option>
+  </select>
+  <label>layer <select id="layer"></select></label>
+  <label>column <input id="column" type="range"> <span id="column_value"></span></label>
+  <label>S1 <select id="S1"></select></label>
+</div>
+<div id="plot" style="width:1100px;height:900px"></div>
+<script>
+const P = __PAYLOAD__;
+const TYPES = {int16: Int16Array, int32: Int32Array, float32: Float32Array};
+function decode(typed) {
+  const bytes = Uint8Array.from(atob(typed.data), c => c.charCodeAt(0));
+  return new TYPES[typed.dtype](bytes.buffer);
+}
+function decodeAll(obj) {
+  const out = {};
+  for (const [key, value] of Object.entries(obj)) out[key] = (value && value.dtype) ? decode(value) : value;
+  return out;
+}
+const M = decodeAll(P.modules), C = decodeAll(P.pieces), F = decodeAll(P.frames);
+const width = P.sector / P.n_columns;
+const el = id => document.getElementById(id);
+
+// one 'toself' trace per colour, outlines separated by null gaps
+function outlines(xy, offsets, items, colorOf, opacity) {
+  const groups = new Map();
+  for (const i of items) {
+    const color = colorOf(i);
+    if (!groups.has(color)) groups.set(color, {x: [], y: []});
+    const g = groups.get(color), start = offsets[i], stop = offsets[i+1];
+    for (let k = start; k < stop; k++) { g.x.push(xy[2*k]); g.y.push(xy[2*k+1]); }
+    g.x.push(xy[2*start], null); g.y.push(xy[2*start+1], null);
+  }
+  return [...groups].map(([color, g]) => ({x: g.x, y: g.y, fill: 'toself', fillcolor: color, opacity: opacity,
+    mode: 'lines', line: {color: 'black', width: 0.5}, hoverinfo: 'skip', showlegend: false}));
+}
+function labels(items) {
+  return {x: items.map(i => M.x0[i]), y: items.map(i => M.y0[i]), mode: 'text', showlegend: false,
+          text: items.map(i => '(' + M.u[i] + ',' + M.v[i] + ')'),
+          hovertext: items.map(i => 'Module: ' + M.names[i] + '<br>MB: ' + M.MBs[M.MB[i]]), hoverinfo: 'text'};
+}
+function columnLines(column, radius) {
+  const x = [], y = [];
+  for (const c of [column, column + 1]) {
+    const a = c * width * Math.PI / 180;
+    x.push(0, radius * Math.cos(a), null); y.push(0, radius * Math.sin(a), null);
+  }
+  return {x: x, y: y, mode: 'lines', line: {color: 'blue'}, showlegend: false, hoverinfo: 'skip'};
+}
+function layerModules(layer) {
+  const items = [];
+  for (let i = 0; i < M.plane.length; i++) if (M.plane[i] == layer) items.push(i);
+  return items;
+}
+function radiusOf(items) {
+  let r = 0;
+  for (const i of items) for (let k = M.offsets[i]; k < M.offsets[i+1]; k++) r = Math.max(r, Math.hypot(M.xy[2*k], M.xy[2*k+1]));
+  return r;
+}
+
+function modulesView(layer, column) {
+  const items = layerModules(layer), selected = new Set(), MBs = new Set();
+  for (let f = 0; f < F.column.length; f++) {
+    if (F.column[f] != column) continue;
+    if (F.module[f] >= 0) selected.add(F.module[f]); else MBs.add(F.MB[f]);
+  }
+  const colorOf = i => (selected.has(i) || MBs.has(M.MB[i])) ? 'rgb(0, 0, 255)' : 'rgb(255, 255, 255)';
+  return {data: [...outlines(M.xy, M.offsets, items, colorOf, 0.4), labels(items), columnLines(column, radiusOf(items))],
+          title: 'Display layer ' + layer + ', Column' + column};
+}
+function framesView(layer) {
+  const items = [];
+  for (let p = 0; p < C.module.length; p++) if (M.plane[C.module[p]] == layer) items.push(p);
+  const colorOf = p => P.colors[Math.min(C.TCs[p], 3)] || 'white';
+  return {data: [...outlines(C.xy, C.offsets, items, colorOf, 1), labels(layerModules(layer))],
+          title: 'TCs distribution in each frame*column in layer ' + layer};
+}
+function allocationView(select, value, y, names) {
+  const traces = new Map();
+  for (let f = 0; f < F.frame.length; f++) {
+    if (select[f] != value) continue;
+    const key = y === 'S1' ? F.S1[f] : F.channel[f];
+    if (!traces.has(key)) traces.set(key, {x: [], y: [], mode: 'markers', type: 'scattergl', name: names[key]});
+    traces.get(key).x.push(F.frame[f]);
+    traces.get(key).y.push(y === 'S1' ? F.S1s[F.S1[f]] : F.column[f]);
+  }
+  return {data: [...traces.values()], xaxis: 'time [frame]', yaxis: y === 'S1' ? 'S1' : 'columns'};
+}
+
+function draw() {
+  const view = el('view').value, layer = +el('layer').value, column = +el('column').value, S1 = +el('S1').value;
+  el('column_value').textContent = column;
+  let fig, layout = {showlegend: false, hovermode: 'closest'};
+  if (view === 'modules') fig = modulesView(layer, column);
+  else if (view === 'frames') fig = framesView(layer);
+  else if (view === 'S1') {
+    fig = allocationView(F.S1, S1, 'column', F.channels);
+    fig.title = 'Channel allocation algorithm in S1 FPGA ' + F.S1s[S1];
+  } else {
+    fig = allocationView(F.column, column, 'S1', F.S1s);
+    fig.title = 'Channel allocation algorithm for column ' + column;
+  }
+  if (fig.xaxis) layout = {showlegend: true, xaxis: {title: fig.xaxis}, yaxis: {title: fig.yaxis}};
+  else layout.yaxis = {scaleanchor: 'x'};
+  layout.title = fig.title;
+  Plotly.react('plot', fig.data, layout);
+}
+
+for (const layer of [...new Set(M.plane)].sort((a, b) => a - b)) el('layer').add(new Option(layer, layer));
+F.S1s.forEach((name, i) => el('S1').add(new Option(name, i)));
+Object.assign(el('column'), {min: P.first_column, max: P.last_column, value: 0});
+for (const id of ['view', 'layer', 'column', 'S1']) el(id).addEventListener('input', draw);
+draw();
+</script>
+</body>
+</html>
+'''
@@ -0,0 +1,141 @@
+''' differences between two geometries: Geometry.xml / Geometry_old.xml
+    (any id scheme) or Pedro's txt files. Modules are matched on an int64
+    key packed from (plane, u, v, scintillator) and every comparison runs
+    on whole columns. Reported changes:
+     - added / removed:  module present in one geometry only
+     - MB:               module moved to another motherboard. Motherboards are
+                         matched by the modules they share, renamed ids are
+                         not changes (txt MB numbers are per plane)
+     - vertices:         a vertex moved by more than the tolerance [mm], the
+                         distance to the nearest vertex of the other outline
+                         (independent of the vertex order)
+     - TCcount, TriggerLpGbts, DaqRate, trigLinks: value changed, compared
+                         when both geometries have it
+
+    python geometry_diff.py xml/Geometry_old.xml xml/Geometry.xml '''
+
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+import Tools as tools
+import hgcal_ids
+
+COMPARED = ['TCcount', 'TriggerLpGbts', 'DaqRate', 'trigLinks']
+CHANGE_COLUMNS = ['change', 'plane', 'u', 'v', 'scintillator', 'Module_a', 'Module_b', 'a', 'b']
+
+def module_keys(plane, u, v, scintillator):
+    return (np.asarray(plane, dtype=np.int64) << 21) | (np.asarray(scintillator, dtype=np.int64) << 20) | \
+           (np.asarray(u, dtype=np.int64) << 10) | np.asarray(v, dtype=np.int64)
+
+def _scintillator(modules):
+    ''' from the module ids: 0x... ids of Geometry.xml, or the type digit of
+        the old ones (1 for the scintillator) '''
+    modules = pd.Series(modules, dtype=str)
+    new_scheme = modules.str.startswith('0x').to_numpy()
+    _, _, _, scintillator = hgcal_ids.module_fields(hgcal_ids.encode(modules.where(new_scheme, '0x0')))
+    return np.where(new_scheme, scintillator, modules.str[0].to_numpy() == '1')
+
+def load_geometry(path):
+    ''' module table and outlines of an xml or txt geometry, one row per
+        module. The txt is restricted to the trigger layers, as the xml loader '''
+    if path.endswith('.txt'):
+        df, polygons = tools.prepare_geometry_txt(path, return_polygons=True)
+        trigger = ((df['plane'] % 2 == 1) | (df['plane'] >= 27)).to_numpy()
+        df, polygons = df[trigger].reset_index(drop=True), polygons.take(trigger)
+    else:
+        df, polygons = tools.extract_module_info_from_xml(path, return_polygons=True)
+        hgcal_ids.reject_replicas(df['Module_id'], 'geometry_diff')
+        df['scintillator'] = _scintillator(df['Module'])
+        df['TriggerLpGbts'] = pd.to_numeric(df['TriggerLpGbts'])
+    polygons, _ = polygons.without_padding()
+    df['key'] = module_keys(df['plane'], df['u'], df['v'], df['scintillator'])
+    return df, polygons
+
+def padded_vertices(polygons, width=tools.TXT_MAX_VERTICES):
+    ''' (n, width, 2) vertices, NaN after the last vertex of each module '''
+    counts = polygons.counts()
+    padded = np.full((len(polygons), width, 2), np.nan)
+    local = np.arange(len(polygons.xy)) - np.repeat(polygons.offsets[:-1], counts)
+    padded[np.repeat(np.arange(len(polygons)), counts), local] = polygons.xy
+    return padded
+
+def vertex_displacement(a, b):
+    ''' per module pair, the largest distance from a vertex of one outline
+        to the nearest vertex of the other one, from (n, k, 2) padded arrays '''
+    distance = np.linalg.norm(a[:, :, None, :] - b[:, None, :, :], axis=-1)
+    distance = np.where(np.isnan(distance), np.inf, distance)
+    a_to_b = np.where(np.isnan(a[:, :, 0]), 0, distance.min(axis=2)).max(axis=1)
+    b_to_a = np.where(np.isnan(b[:, :, 0]), 0, distance.min(axis=1)).max(axis=1)
+    return np.maximum(a_to_b, b_to_a)
+
+def motherboard_changes(MB_a, MB_b):
+    ''' True for the modules whose motherboard does not follow the one most of
+        its motherboard mates moved to (in either direction) '''
+    a_codes, _ = pd.factorize(MB_a)
+    b_codes, _ = pd.factorize(MB_b)
+    pairs = pd.DataFrame({'a': a_codes, 'b': b_codes})
+    counts = pairs.groupby(['a', 'b']).size().rename('n').reset_index().sort_values('n', ascending=False)
+    image = counts.drop_duplicates('a').set_index('a')['b']
+    preimage = counts.drop_duplicates('b').set_index('b')['a']
+    return (image.reindex(a_codes).to_numpy() != b_codes) | (preimage.reindex(b_codes).to_numpy() != a_codes)
+
+def _changes(change, rows, a, b):
+    return pd.DataFrame({'change': change, 'plane': rows['plane'].to_numpy(), 'u': rows['u'].to_numpy(), 'v': rows['v'].to_numpy(),
+                         'scintillator': rows['scintillator'].to_numpy(), 'Module_a': rows['Module_a'].to_numpy(),
+                         'Module_b': rows['Module_b'].to_numpy(), 'a': a, 'b': b}, columns=CHANGE_COLUMNS)
+
+def diff(a, b, tolerance=1.0, rate_tolerance=0.01):
+    ''' changes from geometry a to geometry b (load_geometry results), one
+        row per (module, change) '''
+    (df_a, polygons_a), (df_b, polygons_b) = a, b
+    keep = ['key', 'plane', 'u', 'v', 'scintillator', 'Module', 'MB'] + [c for c in COMPARED if c in df_a and c in df_b]
+    merged = pd.merge(df_a[keep].assign(row_a=np.arange(len(df_a))), df_b[keep].assign(row_b=np.arange(len(df_b))),
+                      on=['key', 'plane', 'u', 'v', 'scintillator'], how='outer', suffixes=('_a', '_b'), indicator=True)
+
+    removed = merged[merged['_merge'] == 'left_only']
+    added = merged[merged['_merge'] == 'right_only']
+    both = merged[merged['_merge'] == 'both']
+    row_a, row_b = both['row_a'].to_numpy(dtype=np.int64), both['row_b'].to_numpy(dtype=np.int64)
+    tables = [_changes('removed', removed, None, None), _changes('added', added, None, None)]
+
+    plane = both['plane'].astype(str) + ':'
+    moved = motherboard_changes((plane + both['MB_a'].astype(str)).to_numpy(), (plane + both['MB_b'].astype(str)).to_numpy())
+    tables.append(_changes('MB', both[moved], both['MB_a'].astype(str).to_numpy()[moved], both['MB_b'].astype(str).to_numpy()[moved]))
+
+    displacement = vertex_displacement(padded_vertices(polygons_a.take(row_a)), padded_vertices(polygons_b.take(row_b)))
+    shifted = displacement > tolerance
+    tables.append(_changes('vertices', both[shifted], None, displacement[shifted].round(3)))
+
+    for column in keep[7:]:
+        values_a, values_b = both[column + '_a'].to_numpy(dtype=np.float64), both[column + '_b'].to_numpy(dtype=np.float64)
+        changed = ~np.isclose(values_a, values_b, rtol=0, atol=rate_tolerance if column == 'DaqRate' else 0)
+        tables.append(_changes(column, both[changed], values_a[changed], values_b[changed]))
+
+    changes = pd.concat([table for table in tables if len(table)] or tables[:1], ignore_index=True)
+    changes['change'] = pd.Categorical(changes['change'], categories=['removed', 'added', 'MB', 'vertices'] + keep[7:])
+    return changes.sort_values(['plane', 'change', 'u', 'v'], kind='stable').reset_index(drop=True)
+
+def layer_summary(changes, a, b):
+    ''' per plane: the modules of each geometry and the number of changes of
+        each kind '''
+    counts = changes.groupby(['plane', 'change'], observed=False).size().unstack('change', fill_value=0)
+    modules = pd.DataFrame({'modules_a': a[0].groupby('plane').size(), 'modules_b': b[0].groupby('plane').size()})
+    return modules.join(counts, how='outer').fillna(0).astype(np.int64)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Differences between two geometries (xml or txt), exits with 1 if there are any.")
+    parser.add_argument("geometry_a", help="Reference geometry (xml or txt)")
+    parser.add_argument("geometry_b", help="New geometry (xml or txt)")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="Vertex displacement [mm] reported as a change")
+    parser.add_argument("--output",    default=None, help="Save the changes as csv")
+    args = parser.parse_args()
+
+    a, b = load_geometry(args.geometry_a), load_geometry(args.geometry_b)
+    changes = diff(a, b, args.tolerance)
+    with pd.option_context('display.width', 200, 'display.max_rows', 200, 'display.max_columns', None):
+        print(layer_summary(changes, a, b))
+        print(changes['change'].value_counts(sort=False).to_string())
+    if args.output: changes.to_csv(args.output, index=False)
+    sys.exit(1 if len(changes) else 0)
@@ -4,50 +4,19 @@ import os
 import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
-import Tools as tools
+import mapping
 import plotly.io as pio
 pio.kaleido.scope.mathjax = None
 
-def get_MB_ids(region_id):
-    MB_ids = []
-
-    for region in regions:
-        if region.id == region_id:
-            MB_ids.extend(region.MBs.split(';'))
-    return MB_ids
-
-def extract_plane_from_region(id):
-    RegionId = int(id, 16) # hexadecimal 'id' to integer
-
-    lr = RegionId & 1
-    ud = (RegionId >> 1) & 1
-    plane = (RegionId >> 2) & 0b11111
-    section = (RegionId >> 7)
-
-    return lr, ud, plane, section 
-
-
 # main function
 
 region_degree = '120'
 
-if region_degree != '120': tree = ET.parse("xml/S1.SeparateTD.Identical60.SingleTypes.NoSplit.xml")
-else: tree = ET.parse("xml/S1.regions.xml")
-root = tree.getroot()
-
-S1_FPGAs = {}
-df_S1 = pd.DataFrame(columns=['S1', 'modules'])
+if region_degree != '120': S1_file = "xml/S1.SeparateTD.Identical60.SingleTypes.NoSplit.xml"
+else: S1_file = "xml/S1.regions.xml"
 
-for S1_FPGA in root.findall(".//S1"):
-    id_S1 = S1_FPGA.get("id")
-    print(f"S1: {id_S1}")
-    regions = []
-    for region in S1_FPGA.findall("Region"):
-        S1_region = region.get("href")
-        regions.append(S1_region)
-   
-    modules = tools.get_modules_per_S1(regions) 
-    df_S1 = df_S1.append({'S1': id_S1, 'modules': modules}, ignore_index=True)
+# modules, TCs and lpGBTs of all the S1 FPGAs at once
+df_S1 = mapping.load_model(S1_file=S1_file).hierarchy.per_S1()
 
 print(df_S1)
 df_S1.to_excel("xlsx/modules_per_S1.xlsx")
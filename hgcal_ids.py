@@ -0,0 +1,190 @@
+''' hexadecimal ids of the mapping xml files (modules, motherboards,
+    regions, S1 boards, channels). They are decoded once into int64 so that
+    merges and groupbys run on integer keys, and the bit fields packed in
+    them are exposed as vectorized accessors. '''
+
+import numpy as np
+import pandas as pd
+
+MISSING = -1  # code of the missing ids (None/NaN)
+
+class IdRegistry:
+    ''' interns the id strings: each distinct string is decoded once into its
+        integer value, strings that are not hexadecimal get a negative code
+        below MISSING. The original spelling is kept to decode the integers back '''
+    def __init__(self):
+        self.codes = {}
+        self.strings = {}
+
+    def _encode_unique(self, uniques):
+        codes = np.empty(len(uniques), dtype=np.int64)
+        for i, string in enumerate(uniques):
+            code = self.codes.get(string)
+            if code is None:
+                try:
+                    code = int(string, 16)
+                except (TypeError, ValueError):
+                    code = MISSING - 1 - len(self.strings)
+                self.codes[string] = code
+                self.strings.setdefault(code, string)
+            codes[i] = code
+        return codes
+
+    def encode(self, values):
+        ''' int64 array for a Series/array of id strings (categoricals only
+            decode their categories), MISSING where the id is None/NaN '''
+        values = pd.Series(values) if not isinstance(values, pd.Series) else values
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(values)
+        encoded = np.full(len(codes), MISSING, dtype=np.int64)
+        found = codes >= 0
+        encoded[found] = self._encode_unique(list(uniques))[codes[found]]
+        return encoded
+
+    def decode(self, codes):
+        ''' back to the id strings, as they were spelled in the xml '''
+        return pd.Series(codes).map(self.strings).to_numpy()
+
+registry = IdRegistry()
+
+def encode(values):
+    return registry.encode(values)
+
+# bit fields, for integer scalars or arrays
+
+def module_fields(ids):
+    ''' silicon/scintillator module ids of Geometry.xml (0x6...) '''
+    plane = (ids >> 16) & 0x3F
+    u = (ids >> 12) & 0xF
+    v = (ids >> 8) & 0xF
+    scintillator = ((ids >> 23) & 0x3) == 3
+    return plane, u, v, scintillator
+
+def module_ids(plane, u, v, scintillator=False):
+    ''' Geometry.xml id of the modules from their plane, (u, v) and type,
+        the inverse of module_fields '''
+    base = np.where(scintillator, 0x61800000, 0x60000000)
+    return base | (np.asarray(plane, dtype=np.int64) << 16) | (np.asarray(u, dtype=np.int64) << 12) | (np.asarray(v, dtype=np.int64) << 8)
+
+def motherboard_fields(ids):
+    ''' motherboard ids of the Regions.60 file (0x02064): MB number and plane '''
+    MotherboardId = ids & 0x1FFF  # binary: 0001 1111 1111 1111
+    PlaneId = (ids >> 13) & 0xFFFF
+    return MotherboardId, PlaneId
+
+def region_fields(ids):
+    ''' region ids of the 60 degree S1 files (0x00C): lr, ud, plane, section '''
+    lr = ids & 1
+    ud = (ids >> 1) & 1
+    plane = (ids >> 2) & 0b11111
+    section = (ids >> 7) & 0x1F
+    return lr, ud, plane, section
+
+REGION120_BASE = 0x61400000
+CEH_FIRST_PLANE = 27  # local plane 0 of the CE-H sections
+
+def region120_fields(ids):
+    ''' region ids of Regions.120 / S1.regions.xml (0x61430000): plane (1-47)
+        and section (0 CE-E, 1 CE-H silicon, 2 scintillator, 3 DAQ only) '''
+    plane = (ids >> 16) & 0x3F
+    section = (ids >> 1) & 0x3
+    return plane, section
+
+def region120_ids(plane, section):
+    ''' inverse of region120_fields '''
+    return REGION120_BASE | (np.asarray(plane, dtype=np.int64) << 16) | (np.asarray(section, dtype=np.int64) << 1)
+
+def is_region120(ids):
+    # the prefix is above the plane field (bits 16-21)
+    return ((np.asarray(ids) >> 22) & 0x3FF) == (REGION120_BASE >> 22)
+
+def to_region120(ids):
+    ''' 60 degree S1 region ids (0x00C, lr = ud = 0) to the ids of Regions.120,
+        the CE-H planes counting from CEH_FIRST_PLANE '''
+    _, _, plane, section = region_fields(ids)
+    return region120_ids(np.where(section == 0, plane, plane + CEH_FIRST_PLANE), section) | (np.asarray(ids) & REPLICA_MASK)
+
+# synthetic full detector: the copies (3 sectors x 2 endcaps, or more) of
+# the 120 degree sector are told apart by a field above the 32 bits of the
+# mapping ids, which none of the accessors above reads
+
+REPLICA_SHIFT = 32
+MAX_COPIES = 16
+REPLICA_MASK = (MAX_COPIES - 1) << REPLICA_SHIFT
+
+def replicate(ids, copy):
+    ''' id of the given copy (0..MAX_COPIES-1) of a module/MB/region/S1/channel '''
+    if not 0 <= copy < MAX_COPIES: raise ValueError('copy %d out of 0..%d' % (copy, MAX_COPIES - 1))
+    return ids | (copy << REPLICA_SHIFT)
+
+def replica_of(ids):
+    ''' copy index of replicated ids, 0 for the original ones '''
+    return (ids & REPLICA_MASK) >> REPLICA_SHIFT
+
+def reject_replicas(ids, consumer):
+    ''' raises ValueError if some ids are synthetic copies: the copies keep the
+        plane, (u, v) and vertices of the original sector, so the tools keyed
+        on them (consumer) cannot tell them apart '''
+    ids = np.asarray(ids, dtype=np.int64)
+    copies = np.unique(replica_of(ids[ids >= 0]))
+    if (copies != 0).any():
+        raise ValueError('%s does not support the synthetic copies of the sector (copies %s, ids above 32 bits): '
+                         'they share (plane, u, v) and vertices with the original modules' % (consumer, ', '.join(map(str, copies[copies != 0]))))
+
+ACCESSORS = {'module_fields': module_fields, 'motherboard_fields': motherboard_fields, 'region_fields': region_fields,
+             'region120_fields': region120_fields, 'is_region120': is_region120}
+
+def check_replicas(ids, copies=MAX_COPIES):
+    ''' names of the accessors whose result on some copy of the ids differs
+        from the one on the original ids (empty if the replicas are sound) '''
+    ids = np.asarray(ids, dtype=np.int64)
+    failed = []
+    for name, accessor in ACCESSORS.items():
+        original = accessor(ids)
+        original = original if isinstance(original, tuple) else (original,)
+        for copy in range(1, copies):
+            replicated = accessor(replicate(ids, copy))
+            replicated = replicated if isinstance(replicated, tuple) else (replicated,)
+            if not all(np.array_equal(a, b) for a, b in zip(original, replicated)):
+                failed.append(name)
+                break
+    return failed
+
+def replicate_string(string, copy):
+    ''' same as replicate, on a '0x...' id string (non hexadecimal ids get a suffix) '''
+    if not copy: return string
+    try:
+        return '0x%08X' % replicate(int(string, 16), copy)
+    except ValueError:
+        return '%s.%d' % (string, copy)
+
+# whole arrays of id strings to structured arrays
+
+REGION_DTYPE = np.dtype([('id', np.int64), ('lr', np.int8), ('ud', np.int8), ('plane', np.int16), ('section', np.int16)])
+MOTHERBOARD_DTYPE = np.dtype([('id', np.int64), ('MB', np.int32), ('plane', np.int32)])
+
+def split_lists(lists, sep=';'):
+    ''' 'a;b;c' attributes to the flat list of items and, for each item,
+        the position of the list it comes from '''
+    lists = list(lists)
+    items = sep.join(lists).split(sep) if lists else []
+    counts = np.array([string.count(sep) + 1 for string in lists], dtype=np.int64)
+    return items, np.repeat(np.arange(len(lists)), counts)
+
+def decode_regions(strings):
+    ''' region id strings to a REGION_DTYPE array '''
+    ids = encode(strings)
+    decoded = np.empty(len(ids), dtype=REGION_DTYPE)
+    decoded['id'] = ids
+    decoded['lr'], decoded['ud'], decoded['plane'], decoded['section'] = region_fields(ids)
+    return decoded
+
+def decode_motherboards(strings):
+    ''' motherboard id strings to a MOTHERBOARD_DTYPE array '''
+    ids = encode(strings)
+    decoded = np.empty(len(ids), dtype=MOTHERBOARD_DTYPE)
+    decoded['id'] = ids
+    decoded['MB'], decoded['plane'] = motherboard_fields(ids)
+    return decoded
@@ -0,0 +1,94 @@
+''' the S1 -> regions -> motherboards -> modules hierarchy of one 120 degree
+    sector. It is built once from the xml files with the number of modules,
+    trigger cells and trigger lpGBTs of every node, children are looked up
+    through dicts and the totals of all the S1 FPGAs come from one groupby '''
+
+import functools
+import numpy as np
+import pandas as pd
+import xml.etree.ElementTree as ET
+
+import Tools as tools
+import xml_cache
+
+COUNTS = ['modules', 'TCs', 'lpGBTs']
+
+@xml_cache.cached('S1_regions', version=2)
+def read_S1_regions(xml_file):
+    ''' one row per (S1, Region) reference of an S1 xml, the regions being
+        either Region children (S1.regions.xml) or a Regions="a;b" list '''
+    root = ET.parse(xml_file).getroot()
+    rows = []
+    for S1 in root.findall('.//S1'):
+        regions = [region.get('href') for region in S1.findall('Region')]
+        if S1.get('Regions'): regions += S1.get('Regions').split(';')
+        rows.extend((S1.get('id'), region) for region in regions)
+    return pd.DataFrame(rows, columns=['S1', 'Region'])
+
+def _children(df, parent, child):
+    return {key: df[child].to_numpy()[positions] for key, positions in df.groupby(parent, sort=False).indices.items()}
+
+class MappingHierarchy:
+    ''' S1_regions: (S1, Region), region_MBs: (Region, MB) and geometry as
+        returned by Tools.extract_module_info_from_xml '''
+    def __init__(self, S1_regions, region_MBs, geometry):
+        region_MBs = region_MBs[region_MBs['MB'] != '']
+        modules = geometry.drop_duplicates('Module')
+
+        # counts per node, from the motherboards up
+        MBs = modules.groupby('MB', sort=False).agg(modules=('Module', 'size'), TCs=('MB_TCcount', 'first'),
+                                                    lpGBTs=('TriggerLpGbts', 'first'))
+        MBs['lpGBTs'] = MBs['lpGBTs'].astype(float).astype(int)
+        self.motherboards = MBs.reindex(pd.unique(pd.concat([MBs.index.to_series(), region_MBs['MB']])), fill_value=0)
+        self.motherboards.index.name = 'MB'
+
+        links = region_MBs.join(self.motherboards, on='MB')
+        self.regions = links.groupby('Region', sort=False).agg(motherboards=('MB', 'size'),
+                                                              **{c: (c, 'sum') for c in COUNTS})
+        self.regions = self.regions.reindex(pd.unique(pd.concat([self.regions.index.to_series(), S1_regions['Region']])), fill_value=0)
+        self.regions.index.name = 'Region'
+
+        links = S1_regions.join(self.regions, on='Region')
+        self.S1s = links.groupby('S1', sort=False).agg(regions=('Region', 'size'), motherboards=('motherboards', 'sum'),
+                                                       **{c: (c, 'sum') for c in COUNTS})
+
+        self._regions = _children(S1_regions, 'S1', 'Region')
+        self._motherboards = _children(region_MBs, 'Region', 'MB')
+        self._modules = _children(modules, 'MB', 'Module')
+        self._region_of_MB = pd.Series(region_MBs['Region'].to_numpy(), index=region_MBs['MB'].to_numpy())
+        self._S1_of_region = pd.Series(S1_regions['S1'].to_numpy(), index=S1_regions['Region'].to_numpy())
+
+    @classmethod
+    def from_files(cls, S1_file='xml/S1.regions.xml', regions_file='xml/Regions.120.NoSplit.xml', geometry_file='xml/Geometry.xml'):
+        return cls(read_S1_regions(S1_file), tools.read_regions_table(regions_file),
+                   tools.extract_module_info_from_xml(geometry_file))
+
+    def regions_of(self, S1):
+        return self._regions.get(S1, np.array([], dtype=object))
+
+    def motherboards_of(self, region):
+        return self._motherboards.get(region, np.array([], dtype=object))
+
+    def modules_of(self, MB):
+        return self._modules.get(MB, np.array([], dtype=object))
+
+    def region_totals(self, regions):
+        ''' counts of the given regions, one row each (0 if unknown); the modules
+            read out by an S1 are region_totals(regions)['modules'].sum() '''
+        return self.regions.reindex(regions, fill_value=0)
+
+    def per_S1(self):
+        ''' regions, motherboards, modules, TCs and lpGBTs of every S1 FPGA '''
+        return self.S1s.reset_index()
+
+    def module_table(self):
+        ''' one row per module with the Region and S1 it is read out by '''
+        modules = pd.DataFrame({'Module': np.concatenate(list(self._modules.values())) if self._modules else [],
+                                'MB': np.repeat(list(self._modules), [len(v) for v in self._modules.values()])})
+        modules['Region'] = self._region_of_MB.reindex(modules['MB']).to_numpy()
+        modules['S1'] = self._S1_of_region.reindex(modules['Region']).to_numpy()
+        return modules
+
+@functools.lru_cache(maxsize=None)
+def load_hierarchy(S1_file='xml/S1.regions.xml', regions_file='xml/Regions.120.NoSplit.xml', geometry_file='xml/Geometry.xml'):
+    return MappingHierarchy.from_files(S1_file, regions_file, geometry_file)
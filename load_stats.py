@@ -0,0 +1,78 @@
+''' trigger cell load of the S2 columns: number of TCs sent by each
+    (S1, module) to each column. All the counts come from a single
+    np.bincount on a dense (S1, module) x column index, the scintillator
+    motherboards being treated as modules '''
+
+import numpy as np
+import pandas as pd
+
+import columns
+
+LABELS = ['BC_LOW', 'BC_HIGH', 'STC_16', 'STC_4']
+
+def module_labels(TCs, plane):
+    ''' trigger cell selection of a module on an S1, from its number of TCs
+        (None if it does not fall in any of them) '''
+    conditions = [
+       (TCs <= 7) & (plane < 27),
+       ((TCs == 8) | (TCs == 9)) & (plane < 27),
+       (TCs <= 3) & (plane >= 27),
+       (TCs >= 6) & (plane >= 27),
+    ]
+    return np.select(conditions, LABELS, default=None)
+
+class LoadStatistics:
+    ''' counts[i, c] is the number of TCs of the (S1, module) pair i in the
+        column first + c. The pairs are sorted by S1, those of the k-th S1
+        being S1_offsets[k]:S1_offsets[k+1] '''
+    def __init__(self, frames, first=columns.FIRST_COLUMN, last=columns.LAST_COLUMN):
+        si, sci = frames['si'], frames['sci']
+        S1 = pd.Categorical(np.concatenate([si['S1'].astype(str).to_numpy(), sci['S1'].astype(str).to_numpy()]))
+        unit = np.concatenate([si['Module_id'].to_numpy(), sci['MB_id'].to_numpy()])
+        name = np.concatenate([si['Module'].to_numpy(), sci['MB'].to_numpy()])
+        plane = np.concatenate([si['plane'].to_numpy(), sci['plane'].to_numpy()])
+        column = np.concatenate([si['Column'].to_numpy(), sci['Column'].to_numpy()]).astype(np.int64) - first
+        outside = (column < 0) | (column > last - first)
+        if outside.any():
+            raise ValueError('frames sent to columns %s, outside %d..%d' % (np.unique(column[outside] + first).tolist(), first, last))
+
+        # dense index of the (S1, module) pairs, sorted by S1
+        unit_codes, units = pd.factorize(unit)
+        pair_key = S1.codes.astype(np.int64) * len(units) + unit_codes
+        pair_keys, first_row, pair = np.unique(pair_key, return_index=True, return_inverse=True)
+
+        self.first = first
+        self.n_columns = last - first + 1
+        self.counts = np.bincount(pair * self.n_columns + column,
+                                  minlength=len(pair_keys) * self.n_columns).reshape(len(pair_keys), self.n_columns)
+
+        self.S1_names = np.asarray(S1.categories)
+        self.S1 = S1.codes[first_row]
+        self.S1_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.S1, minlength=len(self.S1_names)))))
+        self.module = name[first_row]
+        self.plane = plane[first_row]
+        self.TCs = self.counts.sum(axis=1)
+        self.label = module_labels(self.TCs, self.plane)
+
+    def columns_per_module(self):
+        return (self.counts > 0).sum(axis=1)
+
+    def max_TCs_per_column(self):
+        return self.counts.max(axis=1)
+
+    def table(self):
+        ''' (S1, Module, module_label, Column, TCcount) of the non empty
+            cells, only for the modules with a label '''
+        pair, column = np.nonzero(self.counts * (self.label != None)[:, None])
+        return pd.DataFrame({'S1': self.S1_names[self.S1[pair]], 'Module': self.module[pair], 'module_label': self.label[pair],
+                             'Column': column + self.first, 'TCcount': self.counts[pair, column]})
+
+    def per_S1(self):
+        ''' for each S1: its name and, for the modules with a label, the
+            number of columns and the max TCs in a column (plot-ready arrays) '''
+        labelled = self.label != None
+        n_columns, max_TCs = self.columns_per_module(), self.max_TCs_per_column()
+        for k, S1 in enumerate(self.S1_names):
+            pairs = slice(self.S1_offsets[k], self.S1_offsets[k+1])
+            keep = labelled[pairs]
+            yield S1, n_columns[pairs][keep], max_TCs[pairs][keep]
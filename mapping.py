@@ -0,0 +1,135 @@
+''' the HGCAL front-end to back-end mapping of one 120 degree sector in
+    memory. Geometry, regions (60 and 120 degree), S1 boards and channel
+    allocation are each read once (through the xml cache) into columnar
+    tables joined on integer ids, the scripts query them from here '''
+
+import functools
+import numpy as np
+import pandas as pd
+
+import Tools as tools
+import hgcal_ids
+import hierarchy
+import columns
+
+GEOMETRY_FILE   = 'xml/Geometry.xml'
+ALLOCATION_FILE = 'xml/ChannelAllocation_SeparateTD-120-MixedTypes-NoSplit.xml'
+REGIONS_FILE    = 'xml/Regions.120.NoSplit.xml'
+REGIONS60_FILE  = 'xml/Regions.60.NoSplit.xml'
+S1_FILE         = 'xml/S1.regions.xml'
+
+class MappingModel:
+    ''' tables are loaded lazily, on their first use:
+         - geometry:   one row per module (Module_id, MB_id, plane, u, v, vertices...)
+         - regions:    (Region, MB) of the 120 degree regions, regions60 the 60 degree ones
+         - S1_regions: (S1, Region)
+         - allocation: one row per frame of si and sci, with S1 and Channel
+                       categorical and Module_id / MB_id (-1 if none) int64
+         - frames:     the allocation joined with the geometry, per detector '''
+    def __init__(self, geometry_file=GEOMETRY_FILE, allocation_file=ALLOCATION_FILE, regions_file=REGIONS_FILE,
+                 regions60_file=REGIONS60_FILE, S1_file=S1_FILE):
+        self.geometry_file = geometry_file
+        self.allocation_file = allocation_file
+        self.regions_file = regions_file
+        self.regions60_file = regions60_file
+        self.S1_file = S1_file
+
+    def with_allocation(self, allocation_file):
+        ''' model of another allocation scenario, sharing the tables already
+            loaded that do not depend on it (geometry, regions, S1 boards) '''
+        model = MappingModel(self.geometry_file, allocation_file, self.regions_file, self.regions60_file, self.S1_file)
+        for name in ('geometry', 'regions', 'regions60', 'S1_regions', 'hierarchy'):
+            if name in self.__dict__: model.__dict__[name] = self.__dict__[name]
+        return model
+
+    # tables
+
+    @functools.cached_property
+    def geometry(self):
+        return tools.extract_module_info_from_xml(self.geometry_file)
+
+    @functools.cached_property
+    def regions(self):
+        regions = tools.read_regions_table(self.regions_file)
+        regions = regions[regions['MB'] != ''].reset_index(drop=True)
+        regions['Region_id'] = hgcal_ids.encode(regions['Region'])
+        regions['MB_id'] = hgcal_ids.encode(regions['MB'])
+        return regions
+
+    @functools.cached_property
+    def regions60(self):
+        return tools.extract_60regions_MB_from_xml(self.regions60_file)
+
+    @functools.cached_property
+    def S1_regions(self):
+        return hierarchy.read_S1_regions(self.S1_file)
+
+    @functools.cached_property
+    def hierarchy(self):
+        return hierarchy.MappingHierarchy(self.S1_regions, tools.read_regions_table(self.regions_file), self.geometry)
+
+    @functools.cached_property
+    def raw_frames(self):
+        return tools.read_channel_allocation(self.allocation_file)
+
+    @functools.cached_property
+    def frames(self):
+        return tools.join_geometry(self.raw_frames, self.geometry)
+
+    @functools.cached_property
+    def allocation(self):
+        si, sci = self.raw_frames['si'], self.raw_frames['sci']
+        MB_of_module = pd.Series(self.geometry['MB_id'].to_numpy(), index=self.geometry['Module_id'].to_numpy())
+        MB_of_module = MB_of_module[~MB_of_module.index.duplicated()]
+
+        si_ids = hgcal_ids.encode(si['Module'])
+        allocation = pd.concat([
+            si.drop(columns='Module').assign(Module_id=si_ids, MB_id=MB_of_module.reindex(si_ids, fill_value=-1).to_numpy()),
+            sci.drop(columns='MB').assign(Module_id=np.int64(-1), MB_id=hgcal_ids.encode(sci['MB'])),
+        ], ignore_index=True)
+        return allocation
+
+    def overlap_index(self, key='Module'):
+        return columns.load_overlap_index(self.geometry_file, key)
+
+    # queries
+
+    @functools.cached_property
+    def _rows_of_module(self):
+        return self.allocation.groupby('Module_id', sort=False).indices
+
+    @functools.cached_property
+    def _rows_of_MB(self):
+        return self.allocation.groupby('MB_id', sort=False).indices
+
+    def frames_of_module(self, module):
+        ''' frames of a silicon module (hex string or integer id) '''
+        module = hgcal_ids.encode([module])[0] if isinstance(module, str) else module
+        return self.allocation.iloc[self._rows_of_module.get(module, [])]
+
+    def frames_of_motherboard(self, MB):
+        ''' frames of all the modules of a motherboard, and of it for the scintillator '''
+        MB = hgcal_ids.encode([MB])[0] if isinstance(MB, str) else MB
+        return self.allocation.iloc[self._rows_of_MB.get(MB, [])]
+
+    def modules_on_S1(self, S1):
+        ''' silicon modules having frames on an S1 FPGA (hex strings) '''
+        allocation = self.allocation
+        ids = pd.unique(allocation['Module_id'].to_numpy()[(allocation['S1'] == S1).to_numpy() & (allocation['Module_id'] >= 0).to_numpy()])
+        return hgcal_ids.registry.decode(ids)
+
+    def tc_load(self):
+        ''' number of trigger cells sent by each S1 FPGA to each column '''
+        return self.allocation.groupby(['S1', 'Column'], observed=True).size().rename('TCs')
+
+    def channels_feeding(self, column):
+        ''' (S1, Channel) pairs with frames in a column, with their number of frames '''
+        allocation = self.allocation
+        in_column = allocation[allocation['Column'] == column]
+        return in_column.groupby(['S1', 'Channel'], observed=True).size().rename('frames').reset_index()
+
+@functools.lru_cache(maxsize=None)
+def load_model(geometry_file=GEOMETRY_FILE, allocation_file=ALLOCATION_FILE, regions_file=REGIONS_FILE,
+               regions60_file=REGIONS60_FILE, S1_file=S1_FILE):
+    ''' one model per set of files and per process '''
+    return MappingModel(geometry_file, allocation_file, regions_file, regions60_file, S1_file)
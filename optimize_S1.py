@@ -0,0 +1,278 @@
+''' reassignment of the regions to the S1 FPGAs balancing their TCcount,
+    TriggerLpGbts and DaqRate (read from the Regions xml), by simulated
+    annealing. The cost is the weighted sum over these quantities of
+    sum_S1 (total - mean)^2 / mean^2. The mean does not depend on the
+    assignment, so moving a region of loads w from S1 a to S1 b changes the
+    cost by 2 w (B - A + w) / mean^2 per quantity, in O(1) from the running
+    totals A, B of the two S1s; a swap of two regions likewise.
+
+    Regions only go to the S1s reading out regions of the same lr/ud in the
+    input, and of the same section when every input S1 reads out a single
+    section (SingleTypes scenarios). No S1 gets more regions than the
+    fullest one of the input. The result is an S1 xml in the schema of the
+    input one.
+
+    python optimize_S1.py --S1 xml/S1.SeparateTD.120.MixedTypes.NoSplit.xml --output S1.optimized.xml '''
+
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import xml.etree.ElementTree as ET
+
+import Tools as tools
+import hgcal_ids
+import hierarchy
+import mapping
+import profiling
+
+BALANCED = tools.REGION_LOADS
+BATCH = 100000  # moves drawn at once
+
+def region_keys(regions):
+    ''' lr, ud and section of the region id strings of an S1 xml, 60 degree
+        (0x00C) or Regions.120 (0x61430000) ids '''
+    ids = hgcal_ids.encode(regions)
+    lr, ud, _, section = hgcal_ids.region_fields(ids)
+    _, section120 = hgcal_ids.region120_fields(ids)
+    region120 = hgcal_ids.is_region120(ids)
+    return np.where(region120, 0, lr), np.where(region120, 0, ud), np.where(region120, section120, section)
+
+def regions_file_of(regions):
+    ''' the Regions xml of the region id strings of an S1 xml: Regions.60 if
+        some 60 degree ids have lr or ud set (Identical60 files), Regions.120
+        otherwise '''
+    ids = hgcal_ids.encode(regions)
+    lr, ud, _, _ = hgcal_ids.region_fields(ids)
+    sector60 = ~hgcal_ids.is_region120(ids) & ((lr == 1) | (ud == 1))
+    return mapping.REGIONS60_FILE if sector60.any() else mapping.REGIONS_FILE
+
+def region_loads(regions, regions_file=None):
+    ''' (n, 3) TCcount, TriggerLpGbts and DaqRate of the region id strings, the
+        60 degree ids of the 120 degree S1 files through to_region120. The
+        regions file defaults to regions_file_of(regions) '''
+    regions_file = regions_file or regions_file_of(regions)
+    table = tools.read_region_loads(regions_file)
+    loads = table[BALANCED].set_axis(hgcal_ids.encode(table['Region']))
+    ids = hgcal_ids.encode(regions)
+    lr, ud, _, _ = hgcal_ids.region_fields(ids)
+    translate = ~hgcal_ids.is_region120(ids) & (lr == 0) & (ud == 0)
+    found = loads.index.get_indexer(ids)
+    found = np.where((found < 0) & translate, loads.index.get_indexer(hgcal_ids.to_region120(ids)), found)
+    if (found < 0).any():
+        raise ValueError('regions %s not in %s' % (', '.join(pd.unique(np.asarray(regions)[found < 0])), regions_file))
+    return loads.to_numpy(dtype=np.float64)[found]
+
+class Assignment:
+    ''' regions -> S1 FPGAs with the running totals of the balanced
+        quantities. loads: (regions, quantities), S1: index of the S1 of each
+        region, allowed: (regions, S1s) mask of the S1s a region can go to '''
+    def __init__(self, regions, S1_names, loads, S1, allowed, max_regions, weights=None):
+        self.regions = np.asarray(regions)
+        self.S1_names = np.asarray(S1_names)
+        self.loads = np.asarray(loads, dtype=np.float64)
+        self.allowed = np.asarray(allowed, dtype=bool)
+        self.max_regions = max_regions
+
+        mean = self.loads.sum(axis=0) / len(self.S1_names)
+        weights = np.ones(self.loads.shape[1]) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.scale = np.where(mean > 0, weights / np.where(mean > 0, mean, 1)**2, 0.)
+        self.offset = len(self.S1_names) * (self.scale * mean**2).sum()
+        self.assign(S1)
+
+    @classmethod
+    def from_files(cls, S1_file=mapping.S1_FILE, regions_file=None, weights=None, max_regions=None,
+                   single_section=None):
+        ''' the assignment of an S1 xml; single_section (default: as in the
+            input) keeps each S1 to one section '''
+        S1_regions = hierarchy.read_S1_regions(S1_file)
+        S1, S1_names = pd.factorize(S1_regions['S1'])
+        lr, ud, section = region_keys(S1_regions['Region'])
+        if single_section is None:
+            single_section = pd.Series(section).groupby(S1).nunique().max() == 1
+        keys, _ = pd.factorize(pd.MultiIndex.from_arrays([lr, ud, section if single_section else np.zeros_like(section)]))
+
+        # an S1 takes the kinds of regions it reads out in the input
+        held = np.zeros((keys.max() + 1, len(S1_names)), dtype=bool)
+        held[keys, S1] = True
+        max_regions = max_regions or np.bincount(S1).max()
+        return cls(S1_regions['Region'], S1_names, region_loads(S1_regions['Region'], regions_file), S1, held[keys],
+                   max_regions, weights)
+
+    def assign(self, S1):
+        ''' sets the S1 of every region and recomputes the totals from scratch '''
+        self.S1 = np.array(S1, dtype=np.int64)
+        self.totals = np.zeros((len(self.S1_names), self.loads.shape[1]))
+        np.add.at(self.totals, self.S1, self.loads)
+        self.counts = np.bincount(self.S1, minlength=len(self.S1_names))
+
+    def cost(self):
+        return float((self.scale * self.totals**2).sum() - self.offset)
+
+    def move_delta(self, region, target):
+        ''' cost change of moving the region to the target S1 '''
+        if self.S1[region] == target: return 0.
+        w = self.loads[region]
+        return 2 * float((self.scale * w * (self.totals[target] - self.totals[self.S1[region]] + w)).sum())
+
+    def swap_delta(self, region, other):
+        ''' cost change of exchanging the S1s of two regions '''
+        if self.S1[region] == self.S1[other]: return 0.
+        d = self.loads[other] - self.loads[region]
+        return 2 * float((self.scale * d * (self.totals[self.S1[region]] - self.totals[self.S1[other]] + d)).sum())
+
+    def move(self, region, target):
+        source = self.S1[region]
+        self.totals[source] -= self.loads[region]
+        self.totals[target] += self.loads[region]
+        self.counts[source] -= 1
+        self.counts[target] += 1
+        self.S1[region] = target
+
+    def swap(self, region, other):
+        d = self.loads[other] - self.loads[region]
+        self.totals[self.S1[region]] += d
+        self.totals[self.S1[other]] -= d
+        self.S1[region], self.S1[other] = self.S1[other], self.S1[region]
+
+    def valid(self):
+        return bool(self.allowed[np.arange(len(self.S1)), self.S1].all() and self.counts.max() <= self.max_regions)
+
+    def table(self):
+        ''' regions and totals of every S1 '''
+        table = pd.DataFrame(self.totals, columns=BALANCED, index=pd.Index(self.S1_names, name='S1'))
+        table.insert(0, 'regions', self.counts)
+        order = np.argsort(hgcal_ids.encode(self.regions), kind='stable')
+        regions = pd.Series(self.regions[order]).groupby(self.S1[order]).agg(';'.join)
+        table.insert(1, 'Regions', regions.reindex(range(len(table)), fill_value='').to_numpy())
+        return table.round(2)
+
+    def temperature(self, samples=1000, seed=0):
+        ''' mean |cost change| of random moves, the starting temperature '''
+        rng = np.random.default_rng(seed)
+        regions = rng.integers(len(self.S1), size=samples)
+        targets = rng.integers(len(self.S1_names), size=samples)
+        w = self.loads[regions]
+        delta = 2 * (self.scale * w * (self.totals[targets] - self.totals[self.S1[regions]] + w)).sum(axis=1)
+        return float(np.abs(delta).mean()) or 1.
+
+@profiling.profiled('optimize.anneal')
+def anneal(assignment, moves=5000000, temperature=None, cooling=1e-4, swap_fraction=0.5, seed=0):
+    ''' simulated annealing over moves and swaps, from temperature (default:
+        Assignment.temperature) down to temperature * cooling. The state is
+        kept in python lists, each move is scored and applied in O(1); the
+        assignment is left at the best state visited '''
+    rng = np.random.default_rng(seed)
+    n_regions, n_quantities = assignment.loads.shape
+    quantities = range(n_quantities)
+    loads, scale = assignment.loads.tolist(), assignment.scale.tolist()
+    totals, counts, S1 = assignment.totals.tolist(), assignment.counts.tolist(), assignment.S1.tolist()
+    allowed = assignment.allowed.tolist()
+    targets = [np.flatnonzero(row).tolist() for row in assignment.allowed]
+    max_regions = assignment.max_regions
+
+    start_temperature = temperature or assignment.temperature(seed=seed)
+    cost = best = assignment.cost()
+    initial, best_S1 = cost, S1[:]
+    evaluated = accepted = 0
+    start = time.perf_counter()
+    for first in range(0, moves, BATCH):
+        n = min(BATCH, moves - first)
+        # Metropolis: accepted if delta < -T log(u)
+        T = start_temperature * cooling ** ((first + np.arange(n)) / moves)
+        thresholds = (-T * np.log1p(-rng.random(n))).tolist()
+        draws = zip(rng.integers(n_regions, size=n).tolist(), rng.integers(n_regions, size=n).tolist(),
+                    rng.random(n).tolist(), (rng.random(n) < swap_fraction).tolist(), thresholds)
+        for region, other, pick, swap, threshold in draws:
+            source = S1[region]
+            w, A = loads[region], totals[source]
+            if swap:
+                target = S1[other]
+                if target == source or not allowed[region][target] or not allowed[other][source]: continue
+                v, B = loads[other], totals[target]
+                delta = 0.
+                for m in quantities:
+                    d = v[m] - w[m]
+                    delta += scale[m] * d * (A[m] - B[m] + d)
+                delta *= 2
+                evaluated += 1
+                if delta >= threshold: continue
+                for m in quantities:
+                    d = v[m] - w[m]
+                    A[m] += d
+                    B[m] -= d
+                S1[region], S1[other] = target, source
+            else:
+                options = targets[region]
+                target = options[int(pick * len(options))]
+                if target == source or counts[target] >= max_regions: continue
+                B = totals[target]
+                delta = 0.
+                for m in quantities:
+                    delta += scale[m] * w[m] * (B[m] - A[m] + w[m])
+                delta *= 2
+                evaluated += 1
+                if delta >= threshold: continue
+                for m in quantities:
+                    A[m] -= w[m]
+                    B[m] += w[m]
+                counts[source] -= 1
+                counts[target] += 1
+                S1[region] = target
+            accepted += 1
+            cost += delta
+            if cost < best - 1e-12:
+                best, best_S1 = cost, S1[:]
+
+    seconds = time.perf_counter() - start
+    assignment.assign(best_S1)
+    return {'moves': moves, 'evaluated': evaluated, 'accepted': accepted, 'seconds': round(seconds, 3),
+            'moves_per_minute': int(moves / seconds * 60) if seconds else None, 'initial_cost': round(initial, 6),
+            'cost': round(assignment.cost(), 6)}
+
+def write_S1_xml(assignment, output, S1_file):
+    ''' the assignment in the schema of S1_file: Regions="a;b" attributes or
+        Region href children '''
+    template = ET.parse(S1_file).getroot()
+    as_list = any(S1.get('Regions') for S1 in template.iter('S1'))
+    root = ET.Element(template.tag, dict(template.attrib, id=os.path.splitext(os.path.basename(output))[0]))
+    if 'Timestamp' in root.attrib: root.set('Timestamp', time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    for i, name in enumerate(assignment.S1_names):
+        regions = assignment.regions[assignment.S1 == i]
+        regions = regions[np.argsort(hgcal_ids.encode(regions), kind='stable')]
+        if as_list:
+            ET.SubElement(root, 'S1', {'id': name, 'Regions': ';'.join(regions)})
+        else:
+            S1 = ET.SubElement(root, 'S1', {'id': name})
+            for region in regions: ET.SubElement(S1, 'Region', {'href': region})
+    tree = ET.ElementTree(root)
+    ET.indent(tree, space='\t')
+    tree.write(output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reassign the regions to the S1 FPGAs balancing TCcount, TriggerLpGbts and DaqRate.")
+    parser.add_argument("--S1",          default=mapping.S1_FILE, help="Input S1 xml file")
+    parser.add_argument("--regions",     default=None, help="Regions xml file with the region loads (default: Regions.60 for the Identical60 S1 files, Regions.120 otherwise)")
+    parser.add_argument("--moves",       type=int, default=5000000, help="Annealing moves")
+    parser.add_argument("--weights",     type=float, nargs=len(BALANCED), default=None, help="Weights of " + ', '.join(BALANCED))
+    parser.add_argument("--max_regions", type=int, default=None, help="Regions per S1 (default: the fullest input S1)")
+    parser.add_argument("--mixed_types", action="store_true", help="Allow regions of several sections in an S1")
+    parser.add_argument("--seed",        type=int, default=0)
+    parser.add_argument("--output",      default=None, help="Save the new assignment as S1 xml")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    assignment = Assignment.from_files(args.S1, args.regions, args.weights, args.max_regions, False if args.mixed_types else None)
+    before = assignment.table()
+    result = anneal(assignment, args.moves, seed=args.seed)
+    after = assignment.table()
+
+    with pd.option_context('display.width', 200, 'display.max_rows', 100, 'display.max_colwidth', 60):
+        print("before:\n", before, "\n\nafter:\n", after, sep='')
+        print(pd.DataFrame({'max/mean before': before[BALANCED].max() / before[BALANCED].mean(),
+                            'max/mean after' : after[BALANCED].max() / after[BALANCED].mean()}).round(3))
+    print(', '.join(f"{key}: {value}" for key, value in result.items()))
+    if args.output: write_S1_xml(assignment, args.output, args.S1)
@@ -0,0 +1,155 @@
+''' stage timing of the pipeline: xml parsing, merges, per-layer
+    processing, figure construction and image export are wrapped in spans.
+    Profiling is off by default and a disabled span costs one flag check.
+    Enable it with HGCAL_PROFILE=1 (or --profile): a per-stage summary is
+    printed at exit, and with HGCAL_PROFILE_TRACE=trace.json (or
+    --profile_trace) the spans are also saved as a Chrome trace, to open
+    in chrome://tracing or https://ui.perfetto.dev. Spans recorded in the
+    render workers are sent back with their figure.
+
+    with profiling.span('layer', plane=plane): ...
+
+    @profiling.profiled('merge.geometry')
+    def join_geometry(...): ... '''
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import numpy as np
+import pandas as pd
+
+_enabled = os.environ.get('HGCAL_PROFILE', '0') not in ('', '0')
+_trace_file = os.environ.get('HGCAL_PROFILE_TRACE') or None
+_events = []
+_registered = False
+
+def enabled():
+    return _enabled
+
+def enable(trace_file=None):
+    ''' starts recording the spans, also in the processes started afterwards '''
+    global _enabled, _trace_file, _registered
+    _enabled = True
+    _trace_file = trace_file or _trace_file
+    os.environ['HGCAL_PROFILE'] = '1'
+    if _trace_file: os.environ['HGCAL_PROFILE_TRACE'] = _trace_file
+    if not _registered:
+        atexit.register(report)
+        _registered = True
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time spent in each stage at exit (or set HGCAL_PROFILE=1)")
+    parser.add_argument("--profile_trace", default=None,
+                        help="Also save the stages as a Chrome trace json (or set HGCAL_PROFILE_TRACE)")
+
+def configure(args):
+    if args.profile or args.profile_trace or _enabled: enable(args.profile_trace)
+
+class _NullSpan:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def note(self, **args): pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _events.append((self.name, self.start // 1000, (end - self.start) // 1000,
+                        os.getpid(), threading.get_ident(), self.args))
+        return False
+
+    def note(self, **args):
+        ''' adds arguments known only inside the span (e.g. a cache hit) '''
+        self.args.update(args)
+
+def span(name, **args):
+    ''' context manager timing the block as the stage name '''
+    return _Span(name, args) if _enabled else _NULL_SPAN
+
+def profiled(name=None):
+    ''' decorator timing every call of the function as the stage name '''
+    def decorator(function):
+        stage = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled: return function(*args, **kwargs)
+            with _Span(stage, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def drain():
+    ''' the spans recorded so far, removed from this process (render workers) '''
+    events = _events[:]
+    del _events[:]
+    return events
+
+def merge(events):
+    _events.extend(events)
+
+def summary(events=None):
+    ''' per stage: calls, total and self time (without the nested spans of the
+        same thread) in seconds, mean and max in ms, sorted by self time '''
+    events = _events if events is None else events
+    if not events:
+        return pd.DataFrame(columns=['calls', 'total_s', 'self_s', 'mean_ms', 'max_ms'])
+
+    df = pd.DataFrame(events, columns=['stage', 'start', 'duration', 'pid', 'tid', 'args'])
+    df = df.sort_values(['pid', 'tid', 'start', 'duration'], ascending=[True, True, True, False]).reset_index(drop=True)
+
+    # self time: each span gives its duration back to its direct parent
+    children = np.zeros(len(df), dtype=np.int64)
+    stack = []
+    for i, (start, duration, pid, tid) in enumerate(zip(df['start'], df['duration'], df['pid'], df['tid'])):
+        while stack and (stack[-1][1] != (pid, tid) or stack[-1][2] <= start):
+            stack.pop()
+        if stack: children[stack[-1][0]] += duration
+        stack.append((i, (pid, tid), start + duration))
+    df['self'] = df['duration'] - children
+
+    grouped = df.groupby('stage')
+    table = pd.DataFrame({
+        'calls'  : grouped.size(),
+        'total_s': grouped['duration'].sum() / 1e6,
+        'self_s' : grouped['self'].sum() / 1e6,
+        'mean_ms': grouped['duration'].mean() / 1e3,
+        'max_ms' : grouped['duration'].max() / 1e3,
+    })
+    return table.sort_values('self_s', ascending=False).round(3)
+
+def chrome_trace(events=None):
+    ''' the spans in the Chrome trace event format (complete 'X' events) '''
+    events = _events if events is None else events
+    return {'traceEvents': [{'name': name, 'ph': 'X', 'ts': start, 'dur': duration, 'pid': pid, 'tid': tid,
+                             'args': {key: str(value) for key, value in args.items()}}
+                            for name, start, duration, pid, tid, args in events],
+            'displayTimeUnit': 'ms'}
+
+def write_trace(path, events=None):
+    with open(path, 'w') as f: json.dump(chrome_trace(events), f)
+
+def report(file=sys.stderr):
+    ''' prints the summary and writes the trace, called at exit when enabled '''
+    if not _enabled or not _events: return
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print('\nTime per stage:', file=file)
+        print(summary(), file=file)
+    if _trace_file:
+        write_trace(_trace_file)
+        print(f"trace written to {_trace_file}", file=file)
+
+if _enabled: enable()
@@ -3,8 +3,11 @@ import os
 
 import plotly.graph_objects as go
 import plotly.express as px
+import numpy as np
 import pandas as pd
 import Tools as tools
+import hgcal_ids
+import mapping
 import plotly.io as pio
 pio.kaleido.scope.mathjax = None
 
@@ -16,44 +19,26 @@ def get_MB_ids(region_id):
             MB_ids.extend(region.MBs.split(';'))
     return MB_ids
 
-def extract_plane_from_region(id):
-    RegionId = int(id, 16) # hexadecimal 'id' to integer
-
-    lr = RegionId & 1
-    ud = (RegionId >> 1) & 1
-    plane = (RegionId >> 2) & 0b11111
-    section = (RegionId >> 7)
-
-    return lr, ud, plane, section 
-
-
 # main function
 
 region_degree = '120'
 scenario = 'S1.SeparateTD.Identical60.SingleTypes.NoSplit.xml'
 
-if region_degree != '120': tree = ET.parse("xml/"+scenario)
-else: tree = ET.parse("xml/S1.SeparateTD.120.MixedTypes.NoSplit.xml")
-root = tree.getroot()
+if region_degree != '120': S1_file = "xml/"+scenario
+else: S1_file = "xml/S1.SeparateTD.120.MixedTypes.NoSplit.xml"
+S1_regions = mapping.load_model(S1_file=S1_file).S1_regions
 
-S1_FPGAs = {}
-df_S1 = pd.DataFrame(columns=['S1', 'plane', 'section', 'lr'])
+for id_S1 in S1_regions['S1'].unique():
+    print(f"S1: {id_S1}")
 
-for S1_FPGA in root.findall(".//S1"):
-    id_S1 = S1_FPGA.get("id")
-    S1_regions = S1_FPGA.get("Regions")
+# all the regions decoded at once, one row per region
+regions = hgcal_ids.decode_regions(S1_regions['Region'])
+section, lr, local_plane = regions['section'], regions['lr'].astype(float), regions['plane'].astype(float)
 
-    print(f"S1: {id_S1}")
-    
-    regions = []
-    regions.extend(S1_regions.split(';'))
-    
-    for region in regions:
-        lr, ud, local_plane, section = extract_plane_from_region(region)
-        lr = lr + 0.1 if section == 2 and lr == 0 else lr - 0.1 if section == 2 else lr
-        plane = local_plane if section == 0 else (local_plane + 27 if section != 3 else None)
+lr = np.where(section == 2, np.where(lr == 0, lr + 0.1, lr - 0.1), lr)
+plane = np.where(section == 0, local_plane, np.where(section != 3, local_plane + 27, np.nan))
 
-        df_S1 = df_S1.append({'S1': id_S1, 'plane': plane, 'section' : section,'lr': lr}, ignore_index=True)
+df_S1 = pd.DataFrame({'S1': S1_regions['S1'].to_numpy(), 'plane': plane, 'section': section, 'lr': lr})
 
 if region_degree != '120':
     fig  = px.scatter(df_S1[df_S1.lr>=0.9], x='plane', y='lr', color='S1', symbol='S1', title='60 regions to S1 FPGA Mapping', width=840)
@@ -0,0 +1,262 @@
+''' parallel export of the plotly figures to pdf/png.
+    Figures are built in the main process, only their json spec is sent to
+    a pool of worker processes that keep a warm kaleido instance each.
+    Progress is reported in submission order and a figure that fails to
+    render is reported without stopping the others, RenderError is raised
+    once they are all done. With an html dashboard
+    (--html) only the figures matching --static are exported.
+    Figures can be given a fingerprint of their inputs: it is stored in a
+    manifest next to the outputs and the figure is skipped on the next run
+    if the fingerprint did not change (--force to export everything). '''
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import hashlib
+import multiprocessing
+import concurrent.futures as cf
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import profiling
+
+FORMATS = ('pdf', 'png')
+MANIFEST = '.render_manifest.json'
+_active_pool = None
+
+def default_workers():
+    return int(os.environ.get('HGCAL_RENDER_WORKERS', '1'))
+
+def add_arguments(parser, html=True):
+    ''' --workers and --force, and --html/--static for the scripts with a
+        dashboard (html=False for the others) '''
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Number of processes exporting the figures (default: $HGCAL_RENDER_WORKERS or 1)")
+    if html:
+        parser.add_argument("--html", default=None,
+                            help="Write an interactive html dashboard instead of the pdf/png figures")
+        parser.add_argument("--static", action="append", default=None,
+                            help="With --html, figures still exported as pdf/png (glob on the file name, can be repeated)")
+    parser.add_argument("--force", action="store_true",
+                        help="Export all the figures, even those whose inputs did not change since the last run")
+
+def pool(args):
+    ''' the RenderPool configured by the command line options '''
+    return RenderPool(args.workers, static=static_patterns(args), force=args.force)
+
+def static_patterns(args):
+    ''' None (export everything) unless a dashboard is written '''
+    return (args.static or []) if getattr(args, 'html', None) else None
+
+def fingerprint(*parts):
+    ''' md5 of the inputs of a figure: DataFrames/Series, arrays or any value with a repr '''
+    digest = hashlib.md5()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            digest.update(repr(list(part.columns) if isinstance(part, pd.DataFrame) else part.name).encode())
+            digest.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        elif isinstance(part, np.ndarray):
+            digest.update(str(part.dtype).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+class Manifest:
+    ''' fingerprints of the exported figures, by basename. With force no
+        figure is up to date, the fingerprints of the others are kept '''
+    def __init__(self, path=MANIFEST, force=False):
+        self.path = path
+        self.force = force
+        self.entries = self._load()
+        self.changes = {}
+
+    def _load(self):
+        if not os.path.exists(self.path): return {}
+        try:
+            with open(self.path) as f: return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def up_to_date(self, basename, fingerprint):
+        return not self.force and self.entries.get(basename) == fingerprint and \
+               all(os.path.exists(basename + '.' + fmt) for fmt in FORMATS)
+
+    def set(self, basename, fingerprint):
+        ''' fingerprint of an exported figure, None if its export failed '''
+        self.changes[basename] = fingerprint
+        if fingerprint is None: self.entries.pop(basename, None)
+        else: self.entries[basename] = fingerprint
+
+    def save(self):
+        ''' writes the figures exported by this run over the current file '''
+        if not self.changes: return
+        entries = self._load()
+        for basename, fingerprint in self.changes.items():
+            if fingerprint is None: entries.pop(basename, None)
+            else: entries[basename] = fingerprint
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f: json.dump(entries, f, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+def _setup_kaleido():
+    try:
+        pio.kaleido.scope.mathjax = None
+    except AttributeError:
+        pass
+
+def _init_worker():
+    ''' the first export starts kaleido's chromium, pay it once per worker '''
+    profiling.drain()  # spans inherited from the parent by fork
+    _setup_kaleido()
+    try:
+        go.Figure().to_image(format='png', width=10, height=10)
+    except Exception:
+        pass
+
+def _export(spec, basename, formats):
+    start = time.time()
+    try:
+        fig = go.Figure(spec)
+        for fmt in formats:
+            with profiling.span('figure.write_image', file=basename, format=fmt):
+                fig.write_image(basename + '.' + fmt)
+    except Exception as error:
+        return basename, time.time() - start, type(error).__name__ + ': ' + str(error), profiling.drain()
+    return basename, time.time() - start, None, profiling.drain()
+
+class RenderError(RuntimeError):
+    ''' some figures of a RenderPool failed to export, (basename, error) in failures '''
+    def __init__(self, failures):
+        super().__init__('%d figures failed to export: %s' % (len(failures), ', '.join(basename for basename, _ in failures)))
+        self.failures = failures
+
+class RenderPool:
+    ''' with RenderPool(workers): ... routes every write_figure call of the
+        block to the pool, waits for all the exports when leaving it and
+        raises RenderError if any failed '''
+    def __init__(self, workers=None, verbose=True, static=None, force=False):
+        self.workers = default_workers() if workers is None else workers
+        self.static = static
+        self.manifest = Manifest(force=force)
+        self.fingerprints = {}
+        self.skipped = 0
+        self.verbose = verbose
+        self.executor = None
+        self.pending = []
+        self.done = 0
+        self.failures = []
+
+    def __enter__(self):
+        global _active_pool
+        if self.workers > 1:
+            self._start()
+        self._previous, _active_pool = _active_pool, self
+        return self
+
+    def __exit__(self, *exc):
+        global _active_pool
+        try:
+            self.wait()
+        finally:
+            _active_pool = self._previous
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.manifest.save()
+        if self.verbose and self.skipped:
+            print(f"{self.skipped} figures up to date, not exported")
+        if self.failures and exc[0] is None:
+            raise RenderError(self.failures)
+        return False
+
+    def _start(self):
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        self.executor = cf.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                               mp_context=multiprocessing.get_context(method))
+
+    def wanted(self, basename, fingerprint=None):
+        if self.static is not None and not any(fnmatch.fnmatch(basename, pattern) for pattern in self.static):
+            return False
+        if fingerprint is not None and self.manifest.up_to_date(basename, fingerprint):
+            self.skipped += 1
+            return False
+        return True
+
+    def submit(self, fig, basename, formats=FORMATS, fingerprint=None):
+        if not self.wanted(basename, fingerprint):
+            return
+        if fingerprint is not None:
+            self.fingerprints[basename] = fingerprint
+        if self.executor is None:
+            self._report(_export(fig, basename, formats))
+            return
+
+        with profiling.span('figure.serialize', file=basename):
+            job = (fig.to_dict(), basename, tuple(formats))
+
+        self.pending.append((self.executor.submit(_export, *job), job))
+        # bounded queue: figure specs are not accumulated for the whole run
+        while len(self.pending) > 4 * self.workers:
+            self._collect_oldest()
+
+    def _collect_oldest(self):
+        future, job = self.pending.pop(0)
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            # a worker died (e.g. chromium crash): restart the pool and retry the figure once
+            self._restart()
+            try:
+                result = self.executor.submit(_export, *job).result()
+            except BrokenProcessPool as error:
+                self._restart()
+                result = (job[1], 0., 'BrokenProcessPool: ' + str(error), [])
+        self._report(result)
+
+    def _restart(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self._start()
+        self.pending = [(self.executor.submit(_export, *job), job) for _, job in self.pending]
+
+    def wait(self):
+        while self.pending:
+            self._collect_oldest()
+        if self.verbose and self.failures:
+            print(f"{len(self.failures)} of {self.done} figures failed:", file=sys.stderr)
+            for basename, error in self.failures:
+                print(f"    {basename}: {error}", file=sys.stderr)
+        return self.failures
+
+    def _report(self, result):
+        basename, elapsed, error, events = result
+        profiling.merge(events)
+        self.done += 1
+        fingerprint = self.fingerprints.pop(basename, None)
+        if error is not None:
+            self.failures.append((basename, error))
+            self.manifest.set(basename, None)
+        elif fingerprint is not None:
+            self.manifest.set(basename, fingerprint)
+        if self.verbose:
+            status = 'FAILED' if error else 'ok'
+            print(f"[{self.done}] {basename} ({elapsed:.2f} s) {status}")
+
+def wanted(basename, fingerprint=None):
+    ''' False if the figure would not be exported (not requested with --static
+        or inputs unchanged since the last export), to skip building it '''
+    return _active_pool is None or _active_pool.wanted(basename, fingerprint)
+
+def write_figure(fig, basename, formats=FORMATS, fingerprint=None):
+    ''' writes basename.pdf and basename.png, through the active RenderPool if any '''
+    if _active_pool is not None:
+        _active_pool.submit(fig, basename, formats, fingerprint)
+        return
+    for fmt in formats:
+        with profiling.span('figure.write_image', file=basename, format=fmt):
+            fig.write_image(basename + '.' + fmt)
@@ -0,0 +1,131 @@
+''' comparison of channel allocation scenarios (S1toChannels files).
+    The geometry is parsed once and shared by all the scenarios, their
+    frames are stacked in a single table and every metric is computed with
+    one groupby over all of them, so the cost grows linearly with the
+    number of scenarios '''
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+import mapping
+import profiling
+
+SCENARIOS = [
+    'xml/S1toChannels.SeparateTD.120.MixedTypes.NoSplit.xml',
+    'xml/S1toChannels.SeparateTD.120.SingleTypes.NoSplit.xml',
+    'xml/S1toChannels.SeparateTD.Identical60.SingleTypes.NoSplit.xml',
+]
+
+def scenario_names(allocation_files):
+    ''' unique labels of the scenarios: the file paths below their common
+        folder, without extension, and a #n suffix on a file given twice '''
+    paths = [os.path.abspath(allocation_file) for allocation_file in allocation_files]
+    common = os.path.commonpath([os.path.dirname(path) for path in paths])
+    names = [os.path.splitext(os.path.relpath(path, common))[0] for path in paths]
+    seen = {}
+    for i, name in enumerate(names):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1: names[i] = '%s#%d' % (name, seen[name])
+    return names
+
+def stack_allocations(allocation_files, geometry_file=mapping.GEOMETRY_FILE):
+    ''' the allocation tables of all the scenarios, with a categorical
+        scenario column and a unit id: the module for silicon frames, the
+        motherboard for scintillator ones '''
+    model = mapping.load_model(geometry_file=geometry_file)
+    names = scenario_names(allocation_files)
+    tables = []
+    for allocation_file, name in zip(allocation_files, names):
+        allocation = model.with_allocation(allocation_file).allocation
+        tables.append(allocation.assign(scenario=name, S1=allocation['S1'].astype(str), Channel=allocation['Channel'].astype(str)))
+
+    stacked = pd.concat(tables, ignore_index=True)
+    stacked['scenario'] = pd.Categorical(stacked['scenario'], categories=names)
+    stacked['S1'] = stacked['S1'].astype('category')
+    stacked['Channel'] = stacked['Channel'].astype('category')
+    stacked['unit'] = np.where(stacked['Module_id'] >= 0, stacked['Module_id'], stacked['MB_id'])
+    return stacked
+
+def check_units(stacked, reference):
+    ''' the module/MB ids of every scenario must overlap the reference ones:
+        scenarios with another id scheme (ChannelAllocation files use the
+        0x6... ids, S1toChannels files the old ones) cannot be compared '''
+    units = stacked[['scenario', 'unit']].drop_duplicates()
+    reference_units = units.loc[units['scenario'] == reference, 'unit']
+    shared = units['unit'].isin(reference_units).groupby(units['scenario'], observed=True).any()
+    disjoint = shared.index[~shared.to_numpy()].tolist()
+    if disjoint:
+        raise ValueError('scenarios %s share no module/MB id with the reference %s (different id schemes?)'
+                         % (', '.join(map(str, disjoint)), reference))
+
+def column_changes(stacked, reference):
+    ''' per scenario, the number of modules (or scintillator MBs) whose set of
+        columns differs from the one they have in the reference scenario '''
+    pairs = stacked[['scenario', 'unit', 'Column']].drop_duplicates()
+    reference_pairs = pairs[pairs['scenario'] == reference].drop(columns='scenario')
+
+    # the reference pairs repeated for every scenario, a (unit, column) pair
+    # present on one side only marks the unit as changed
+    scenarios = pairs['scenario'].cat.categories
+    repeated = reference_pairs.loc[np.tile(reference_pairs.index, len(scenarios))]
+    repeated['scenario'] = pd.Categorical(np.repeat(scenarios, len(reference_pairs)), categories=scenarios)
+
+    merged = pd.merge(pairs, repeated, on=['scenario', 'unit', 'Column'], how='outer', indicator=True)
+    changed = merged[merged['_merge'] != 'both'].drop_duplicates(['scenario', 'unit'])
+    return changed.groupby('scenario', observed=False).size()
+
+@profiling.profiled('scenarios.compare')
+def compare(allocation_files, geometry_file=mapping.GEOMETRY_FILE, reference=None):
+    ''' one row per scenario:
+         - frames, S1s, channels: totals (channels with at least one frame)
+         - frames_per_S1_max/mean: per-S1 frame occupancy
+         - channel_utilization: mean share of the frames of a channel used
+         - TCs_per_column_max: over the columns, all S1s summed
+         - TCs_per_S1_column_max: over the (S1, column) pairs
+         - columns_per_module: mean number of columns a module is sent to
+         - modules_changed: modules/MBs whose columns differ from the reference
+        (one of the allocation files, the first one by default) '''
+    if reference is not None and reference not in allocation_files:
+        raise ValueError('reference %s is not one of the scenarios' % reference)
+    stacked = stack_allocations(allocation_files, geometry_file)
+    reference = scenario_names(allocation_files)[0 if reference is None else allocation_files.index(reference)]
+    check_units(stacked, reference)
+    frames_per_channel = int(stacked['Frame'].max()) + 1
+
+    by = stacked.groupby
+    per_S1 = by(['scenario', 'S1'], observed=True).size()
+    per_channel = by(['scenario', 'S1', 'Channel'], observed=True).size()
+    per_column = by(['scenario', 'Column'], observed=True).size()
+    per_S1_column = by(['scenario', 'S1', 'Column'], observed=True).size()
+    per_unit = stacked[['scenario', 'unit', 'Column']].drop_duplicates().groupby(['scenario', 'unit'], observed=True).size()
+
+    report = pd.DataFrame({
+        'frames'               : by('scenario', observed=True).size(),
+        'S1s'                  : per_S1.groupby(level='scenario', observed=True).size(),
+        'channels'             : per_channel.groupby(level='scenario', observed=True).size(),
+        'frames_per_S1_max'    : per_S1.groupby(level='scenario', observed=True).max(),
+        'frames_per_S1_mean'   : per_S1.groupby(level='scenario', observed=True).mean(),
+        'channel_utilization'  : per_channel.groupby(level='scenario', observed=True).mean() / frames_per_channel,
+        'TCs_per_column_max'   : per_column.groupby(level='scenario', observed=True).max(),
+        'TCs_per_S1_column_max': per_S1_column.groupby(level='scenario', observed=True).max(),
+        'columns_per_module'   : per_unit.groupby(level='scenario', observed=True).mean(),
+        'modules_changed'      : column_changes(stacked, reference),
+    })
+    return report.round(3)
+
+if __name__ == "__main__":
+    ''' python scenarios.py [allocation xml files] '''
+    parser = argparse.ArgumentParser(description="Compare channel allocation scenarios.")
+    parser.add_argument("allocations", nargs='*', default=SCENARIOS, help="S1toChannels / ChannelAllocation xml files, the first one is the reference")
+    parser.add_argument("--geometry", default=mapping.GEOMETRY_FILE, help="Geometry xml file shared by the scenarios")
+    parser.add_argument("--output",   default=None, help="Save the report as csv")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    report = compare(args.allocations, args.geometry)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(report)
+    if args.output: report.to_csv(args.output)
@@ -0,0 +1,149 @@
+''' point -> module lookups from the hexagonal lattice of the silicon
+    modules. In each plane the module centres follow origin + u*a + v*b,
+    with a, b fitted on the full modules, so the module covering (x, y) is
+    one of the 3x3 lattice neighbours of its rounded (u, v): the nearest of
+    their centres (the lattice point for the partial modules, whose
+    centroid is off). That holds for the modules whose 6 neighbours all exist;
+    for the others (partial modules, modules at the edges of the sector)
+    and for the scintillator tiles, which are not on the lattice, the
+    candidates are checked with an exact point-in-polygon test. Points in
+    the few mm gaps between two full modules, or within ~1 mm of their
+    border, go to the module with the nearest centre. Where a silicon
+    module and a scintillator tile overlap, the silicon module is returned.
+    All the queries take numpy arrays of points.
+
+    index = LatticeIndex.from_xml('xml/Geometry.xml')
+    rows = index.locate(planes, x, y)   # rows of index.geometry, -1 outside '''
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import Tools as tools
+import hgcal_ids
+import columns
+import profiling
+
+NEIGHBOURS = np.array([(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1)])
+CANDIDATES = np.array([(du, dv) for du in (-1, 0, 1) for dv in (-1, 0, 1)])
+MARGIN = 2
+
+class PlaneLattice:
+    ''' lattice of one plane: fitted origin and (a, b) basis, the dense
+        (u, v) -> geometry row grid and the rows needing an exact test '''
+    def __init__(self, rows, u, v, centroids, full, polygons):
+        self.rows = rows
+        design = np.column_stack((np.ones(len(rows)), u, v))
+        basis, *_ = np.linalg.lstsq(design[full], centroids[full], rcond=None)
+        self.origin, self.inverse = basis[0], np.linalg.inv(basis[1:].T)
+        self.centres = np.where(full[:, None], centroids, design @ basis)
+
+        self.grid = np.full((u.max() + 2*MARGIN + 1, v.max() + 2*MARGIN + 1), -1, dtype=np.int64)
+        self.grid[u + MARGIN, v + MARGIN] = np.arange(len(rows))
+        neighbours = self.grid[(u + MARGIN)[:, None] + NEIGHBOURS[:, 0], (v + MARGIN)[:, None] + NEIGHBOURS[:, 1]]
+        self.exact = ~full | (neighbours < 0).any(axis=1)
+        self.polygons = polygons
+        self.tree = shapely.STRtree(polygons)
+
+    def lattice_coordinates(self, x, y):
+        return (np.column_stack((x, y)) - self.origin) @ self.inverse.T
+
+    def nearest(self, x, y):
+        ''' position in the plane of the module with the nearest centre among
+            the lattice neighbours, -1 if there is none '''
+        uv = np.rint(self.lattice_coordinates(x, y)).astype(np.int64)
+        u = np.clip(uv[:, :1] + CANDIDATES[:, 0] + MARGIN, 0, self.grid.shape[0] - 1)
+        v = np.clip(uv[:, 1:] + CANDIDATES[:, 1] + MARGIN, 0, self.grid.shape[1] - 1)
+        candidates = self.grid[u, v]
+        centres = self.centres[np.maximum(candidates, 0)]
+        distance = np.hypot(centres[..., 0] - x[:, None], centres[..., 1] - y[:, None])
+        distance[candidates < 0] = np.inf
+        best = distance.argmin(axis=1)
+        return np.where(np.isfinite(distance[np.arange(len(x)), best]), candidates[np.arange(len(x)), best], -1)
+
+    def contains(self, positions, x, y):
+        ''' exact test of the points against the given modules of the plane '''
+        return shapely.contains_xy(self.polygons[positions], x, y)
+
+class LatticeIndex:
+    ''' one PlaneLattice per plane, plus the scintillator tiles and the
+        sector edges handled with exact point-in-polygon tests '''
+    def __init__(self, geometry, polygons):
+        self.geometry = geometry.reset_index(drop=True)
+        hgcal_ids.reject_replicas(self.geometry['Module_id'], 'LatticeIndex')
+        polygons, _ = polygons.without_padding()
+        self.shapes = polygons.to_shapely()
+        _, _, _, scintillator = hgcal_ids.module_fields(self.geometry['Module_id'].to_numpy())
+
+        # full modules: hexagons with the area of the most common silicon module
+        area = polygons.area()
+        full_area = np.median(area[~scintillator & (polygons.counts() == 6)])
+        full = ~scintillator & (polygons.counts() == 6) & (np.abs(area - full_area) < 0.01 * full_area)
+
+        centres = polygons.centroid()
+        plane = self.geometry['plane'].to_numpy()
+        u, v = self.geometry['u'].to_numpy(), self.geometry['v'].to_numpy()
+        self.lattices, self.tiles = {}, {}
+        for p in np.unique(plane):
+            rows = np.flatnonzero((plane == p) & ~scintillator)
+            self.lattices[p] = PlaneLattice(rows, u[rows], v[rows], centres[rows], full[rows], self.shapes[rows])
+            tiles = np.flatnonzero((plane == p) & scintillator)
+            if len(tiles): self.tiles[p] = (tiles, shapely.STRtree(self.shapes[tiles]))
+
+    @classmethod
+    def from_xml(cls, geometry_file='xml/Geometry.xml'):
+        geometry, polygons = tools.extract_module_info_from_xml(geometry_file, return_polygons=True)
+        return cls(geometry, polygons)
+
+    @profiling.profiled('spatial.locate')
+    def locate(self, planes, x, y):
+        ''' geometry row of the module (or scintillator tile) covering each
+            point, -1 if none. planes can be a scalar or one per point '''
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        planes = np.broadcast_to(np.asarray(planes), x.shape)
+        rows = np.full(x.shape, -1, dtype=np.int64)
+        for p in np.unique(planes):
+            if p not in self.lattices: continue
+            points = np.flatnonzero(planes == p)
+            rows[points] = self._locate_plane(p, x[points], y[points])
+        return rows
+
+    def _locate_plane(self, plane, x, y):
+        lattice = self.lattices[plane]
+        position = lattice.nearest(x, y)
+        found = position >= 0
+        rows = np.where(found, lattice.rows[np.maximum(position, 0)], -1)
+
+        # partial and edge modules: the exact test, then all the modules of the
+        # plane (a point without lattice neighbour is outside the silicon)
+        check = np.flatnonzero(found & lattice.exact[np.maximum(position, 0)])
+        inside = lattice.contains(position[check], x[check], y[check])
+        retry = check[~inside]
+        rows[retry] = -1
+        if len(retry):
+            point, shape = lattice.tree.query(shapely.points(x[retry], y[retry]), predicate='within')
+            rows[retry[point]] = lattice.rows[shape]
+
+        # scintillator tiles, not on the lattice
+        if plane in self.tiles:
+            tiles, tree = self.tiles[plane]
+            missing = np.flatnonzero(rows < 0)
+            point, tile = tree.query(shapely.points(x[missing], y[missing]), predicate='within')
+            rows[missing[point]] = tiles[tile]
+        return rows
+
+    def lookup(self, planes, x, y, hierarchy=None):
+        ''' Module, MB, S1 and column of each point ('' / -1 outside the
+            modules), for trigger cell positions. The S1 comes from the
+            hierarchy (MappingHierarchy) if given '''
+        rows = self.locate(planes, x, y)
+        inside = rows >= 0
+        result = pd.DataFrame({
+            'Module': np.where(inside, self.geometry['Module'].to_numpy()[np.maximum(rows, 0)], ''),
+            'MB'    : np.where(inside, self.geometry['MB'].to_numpy()[np.maximum(rows, 0)], ''),
+            'Column': columns.column_of(x, y),
+        })
+        if hierarchy is not None:
+            S1_of_MB = hierarchy.module_table().drop_duplicates('MB').set_index('MB')['S1']
+            result['S1'] = S1_of_MB.reindex(result['MB']).fillna('').to_numpy()
+        return result
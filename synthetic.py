@@ -0,0 +1,132 @@
+''' synthetic full-detector (or N x scaled) inputs: the geometry, regions,
+    S1 and allocation xml files of the 120 degree sector replicated for the
+    3 sectors of the 2 endcaps, or any number of copies up to
+    hgcal_ids.MAX_COPIES. Each copy gets its own module/MB/region/S1/channel
+    ids (hgcal_ids.replicate, also inside href and Regions lists); the
+    vertices and columns stay in the coordinates of the 120 degree sector,
+    as columns.py expects, so every copy is a valid sector on its own. The
+    copies overlap in space: the tools keyed on (plane, u, v) or on the
+    positions (adjacency, spatial_index, geometry_diff) reject them with
+    hgcal_ids.reject_replicas. Files are streamed: each top-level unit
+    (motherboard of a plane, region, S1 board) is read, written with its
+    copies and released.
+
+    python synthetic.py --copies 6 --output synthetic/ '''
+
+import os
+import sys
+import copy
+import argparse
+import numpy as np
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+import hgcal_ids
+
+SECTORS = 3
+ENDCAPS = 2
+FILES = ['xml/Geometry.xml', 'xml/Regions.120.NoSplit.xml', 'xml/S1.regions.xml',
+         'xml/ChannelAllocation_SeparateTD-120-MixedTypes-NoSplit.xml']
+
+# attributes holding ids, per tag (the Frame id and Plane id are positions, not ids)
+ID_ATTRIBUTES = {'Motherboard': ('id', 'href'), 'Module': ('id',), 'Region': ('id', 'href'),
+                 'S1': ('id',), 'Channel': ('id',), 'Frame': ('Module', 'Motherboard')}
+LIST_ATTRIBUTES = {'S1': ('Regions',), 'Region': ('Motherboards',)}
+
+# in the output names: files written by an older id scheme are not reused
+VERSION = 2
+
+# depth of the replicated units below the root element
+UNIT_DEPTH = {'HGC': 2}
+
+def replica(unit, k):
+    ''' k-th copy of an element, with its ids re-encoded '''
+    if k == 0: return unit
+    unit = copy.deepcopy(unit)
+    for elem in unit.iter():
+        for attribute in ID_ATTRIBUTES.get(elem.tag, ()):
+            if elem.get(attribute): elem.set(attribute, hgcal_ids.replicate_string(elem.get(attribute), k))
+        for attribute in LIST_ATTRIBUTES.get(elem.tag, ()):
+            if elem.get(attribute):
+                elem.set(attribute, ';'.join(hgcal_ids.replicate_string(item, k) for item in elem.get(attribute).split(';')))
+    return unit
+
+def file_ids(input_file):
+    ''' the hexadecimal ids of a file (id attributes and lists) '''
+    ids = set()
+    for _, elem in ET.iterparse(input_file):
+        values = [elem.get(attribute) for attribute in ID_ATTRIBUTES.get(elem.tag, ())]
+        for attribute in LIST_ATTRIBUTES.get(elem.tag, ()):
+            values.extend((elem.get(attribute) or '').split(';'))
+        ids.update(value for value in values if value and value.startswith('0x'))
+    return hgcal_ids.encode(sorted(ids))
+
+def check_ids(files=FILES, copies=SECTORS*ENDCAPS):
+    ''' raises if an id accessor decodes the replicated ids of the files
+        differently from the original ones '''
+    ids = np.concatenate([file_ids(input_file) for input_file in files])
+    failed = hgcal_ids.check_replicas(ids, copies)
+    if failed: raise ValueError('replicated ids decode differently in ' + ', '.join(failed))
+
+def _start_tag(elem):
+    return '<' + elem.tag + ''.join(' %s=%s' % (key, quoteattr(value)) for key, value in elem.attrib.items()) + '>'
+
+def replicate_file(input_file, output_file, copies=SECTORS*ENDCAPS):
+    ''' streams input_file to output_file, each unit followed by its copies '''
+    if copies > hgcal_ids.MAX_COPIES: raise ValueError('at most %d copies' % hgcal_ids.MAX_COPIES)
+    context = ET.iterparse(input_file, events=('start', 'end'))
+    _, root = next(context)
+    unit_depth = UNIT_DEPTH.get(root.tag, 1)
+    depth, parents = 0, [root]
+
+    with open(output_file, 'w') as out:
+        out.write(_start_tag(root))
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                if depth < unit_depth:
+                    out.write('\n' + '\t'*depth + _start_tag(elem))
+                    parents.append(elem)
+                continue
+
+            if depth == 0: break
+            if depth == unit_depth:
+                for k in range(copies):
+                    unit = replica(elem, k)
+                    tail, unit.tail = unit.tail, None
+                    out.write('\n' + '\t'*depth + ET.tostring(unit, encoding='unicode'))
+                    unit.tail = tail
+                parents[-1].remove(elem)
+            elif depth < unit_depth:
+                out.write('\n' + '\t'*depth + '</' + elem.tag + '>')
+                parents.pop()
+                parents[-1].remove(elem)
+            depth -= 1
+        out.write('\n</' + root.tag + '>\n')
+
+def output_path(folder, input_file, copies):
+    return os.path.join(folder, os.path.basename(input_file).replace('.xml', '.x%d.v%d.xml' % (copies, VERSION)))
+
+def full_detector(folder, files=FILES, copies=SECTORS*ENDCAPS):
+    ''' writes the replicated files in folder (kept if already there),
+        returns {input file: replicated file} '''
+    os.makedirs(folder, exist_ok=True)
+    outputs = {input_file: output_path(folder, input_file, copies) for input_file in files}
+    missing = [input_file for input_file, output_file in outputs.items() if not os.path.exists(output_file)]
+    if missing: check_ids(missing, copies)
+    for input_file in missing: replicate_file(input_file, outputs[input_file], copies)
+    return outputs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replicate the 120 degree sector xml files to the full detector.")
+    parser.add_argument("files", nargs='*', default=FILES, help="Geometry, Regions, S1 and allocation xml files")
+    parser.add_argument("--copies", type=int, default=SECTORS*ENDCAPS, help="Number of copies (6: 3 sectors x 2 endcaps)")
+    parser.add_argument("--output", default='synthetic', help="Output folder")
+    args = parser.parse_args()
+
+    try:
+        outputs = full_detector(args.output, args.files, args.copies)
+    except ValueError as error:
+        sys.exit(str(error))
+    for input_file, output_file in outputs.items():
+        print(f"{input_file} -> {output_file}")
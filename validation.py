@@ -0,0 +1,106 @@
+''' automatic checks of a channel allocation, on the frames returned by
+    Tools.extract_data (or MappingModel.frames). Every check runs on all
+    the frames at once and the violations are returned as one table:
+     - collision:  two frames with the same id in the same S1 channel
+     - order:      the TCs of a module (MB for the scintillator) are not sent
+                   in increasing index order within a channel
+     - index:      the indices of a module are not 0..n-1, each once
+     - column:     column outside FIRST_COLUMN..LAST_COLUMN
+     - bandwidth:  more TCs than allowed from one S1 to one column in a frame
+     - TCcount:    number of frames of a module (MB) differs from its
+                   TCcount in the geometry '''
+
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+import columns
+import mapping
+import profiling
+
+VIOLATION_COLUMNS = ['check', 'S1', 'Channel', 'Frame', 'Column', 'unit', 'detail']
+
+def stack_frames(frames):
+    ''' si and sci frames in one table, the unit being the module for the
+        silicon and the motherboard for the scintillator '''
+    keep = ['S1', 'Channel', 'Frame', 'Column', 'idx']
+    si, sci = frames['si'], frames['sci']
+    stacked = pd.concat([
+        si[keep].assign(unit=si['Module_id'].to_numpy(), name=si['Module'].to_numpy(), TCcount=si['TCcount'].to_numpy()),
+        sci[keep].assign(unit=sci['MB_id'].to_numpy(), name=sci['MB'].to_numpy(), TCcount=sci['MB_TCcount'].to_numpy()),
+    ], ignore_index=True)
+    stacked['Column'] = stacked['Column'].astype(np.int16)
+    return stacked
+
+def _violations(check, rows, detail):
+    return pd.DataFrame({'check': check, 'S1': rows['S1'].astype(str).to_numpy(), 'Channel': rows['Channel'].astype(str).to_numpy(),
+                         'Frame': rows['Frame'].to_numpy(), 'Column': rows['Column'].to_numpy(),
+                         'unit': rows['name'].astype(str).to_numpy(), 'detail': detail}, columns=VIOLATION_COLUMNS)
+
+def check_collisions(df):
+    rows = df[df.duplicated(['S1', 'Channel', 'Frame'], keep=False)]
+    return _violations('collision', rows, 'frame id used more than once in the channel')
+
+def check_order(df):
+    df = df.sort_values(['unit', 'S1', 'Channel', 'Frame'])
+    same = (df['unit'].to_numpy()[1:] == df['unit'].to_numpy()[:-1]) & \
+           (df['S1'].to_numpy()[1:] == df['S1'].to_numpy()[:-1]) & \
+           (df['Channel'].to_numpy()[1:] == df['Channel'].to_numpy()[:-1])
+    decreasing = np.zeros(len(df), dtype=bool)
+    decreasing[1:] = same & (np.diff(df['idx'].to_numpy().astype(np.int64)) <= 0)
+    rows = df[decreasing]
+    return _violations('order', rows, 'index ' + rows['idx'].astype(str) + ' sent after a higher one')
+
+def check_indices(df):
+    grouped = df.groupby('unit')['idx']
+    n, largest, unique = grouped.size(), grouped.max(), grouped.nunique()
+    bad = n.index[(unique != n) | (largest + 1 != n)]
+    rows = df[df['unit'].isin(bad)].drop_duplicates('unit')
+    detail = 'indices are not 0..n-1, n=' + n.reindex(rows['unit']).astype(str).to_numpy()
+    return _violations('index', rows, detail)
+
+def check_columns(df, first=columns.FIRST_COLUMN, last=columns.LAST_COLUMN):
+    rows = df[(df['Column'] < first) | (df['Column'] > last)]
+    return _violations('column', rows, 'column outside %d..%d' % (first, last))
+
+def check_bandwidth(df, max_TCs=1):
+    counts = df.groupby(['S1', 'Column', 'Frame'], observed=True)['unit'].transform('size')
+    rows = df[counts > max_TCs]
+    return _violations('bandwidth', rows, counts[counts > max_TCs].astype(str) + ' TCs to the column in the frame (max %d)' % max_TCs)
+
+def check_TCcount(df):
+    grouped = df.groupby('unit')
+    n, expected = grouped.size(), grouped['TCcount'].first()
+    bad = n.index[n != expected]
+    rows = df[df['unit'].isin(bad)].drop_duplicates('unit')
+    detail = n.reindex(rows['unit']).astype(str).to_numpy() + ' frames, TCcount ' + expected.reindex(rows['unit']).astype(str).to_numpy()
+    return _violations('TCcount', rows, detail)
+
+@profiling.profiled('validate')
+def validate(frames, max_TCs=1, first=columns.FIRST_COLUMN, last=columns.LAST_COLUMN):
+    ''' all the violations of the allocation, an empty table if it is valid '''
+    df = stack_frames(frames)
+    return pd.concat([check_collisions(df), check_order(df), check_indices(df),
+                      check_columns(df, first, last), check_bandwidth(df, max_TCs), check_TCcount(df)], ignore_index=True)
+
+if __name__ == "__main__":
+    ''' python validation.py --allocation xml/ChannelAllocation_SeparateTD-120-MixedTypes-NoSplit.xml '''
+    parser = argparse.ArgumentParser(description="Check a channel allocation, exits with 1 if it is not valid.")
+    parser.add_argument("--allocation", default=mapping.ALLOCATION_FILE, help="S1toChannels (or ChannelAllocation) xml file")
+    parser.add_argument("--geometry",   default=mapping.GEOMETRY_FILE, help="Geometry xml file")
+    parser.add_argument("--max_TCs",    type=int, default=1, help="Maximum number of TCs from one S1 to one column in a frame")
+    parser.add_argument("--output",     default=None, help="Save the violations as .csv or .json")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    frames = mapping.load_model(geometry_file=args.geometry, allocation_file=args.allocation).frames
+    violations = validate(frames, args.max_TCs)
+
+    if args.output and args.output.endswith('.json'): violations.to_json(args.output, orient='records', indent=1)
+    elif args.output: violations.to_csv(args.output, index=False)
+
+    counts = violations['check'].value_counts()
+    print(f"{len(violations)} violations" + ''.join(f", {check}: {n}" for check, n in counts.items()))
+    sys.exit(1 if len(violations) else 0)
@@ -0,0 +1,154 @@
+''' on-disk cache of the tables parsed from the xml files.
+    The result of a loader is stored as .npz in a .cache/ folder next to
+    the xml and reused as long as the file content, its Src-hash and its
+    Timestamp do not change; within a process, results are reused while the
+    file keeps its mtime and size, without hashing it again.
+    Set HGCAL_XML_CACHE=0 to always re-parse. '''
+
+import os
+import json
+import hashlib
+import functools
+import numpy as np
+import pandas as pd
+import xml.etree.ElementTree as ET
+
+import profiling
+
+CACHE_DIR = '.cache'
+FORMAT = 2  # layout of the .npz files, part of the key
+_memory = {}
+
+def enabled():
+    return os.environ.get('HGCAL_XML_CACHE', '1') != '0'
+
+def root_attributes(xml_file):
+    ''' Src-hash and Timestamp of the root element, without parsing the rest '''
+    for _, elem in ET.iterparse(xml_file, events=('start',)):
+        return {'Src-hash': elem.get('Src-hash'), 'Timestamp': elem.get('Timestamp')}
+    return {}
+
+def file_key(xml_file, name, version):
+    with open(xml_file, 'rb') as f:
+        content_hash = hashlib.md5(f.read()).hexdigest()
+    key = {'loader': name, 'version': version, 'format': FORMAT, 'md5': content_hash}
+    key.update(root_attributes(xml_file))
+    return json.dumps(key, sort_keys=True)
+
+def cache_path(xml_file, name):
+    folder, filename = os.path.split(os.path.abspath(xml_file))
+    return os.path.join(folder, CACHE_DIR, filename + '.' + name + '.npz')
+
+def _frame_to_arrays(df, prefix):
+    ''' one or more numpy arrays per column, plus the column layout '''
+    arrays, layout = {}, []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        name = prefix + str(i)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays[name + '.codes'] = values.cat.codes.to_numpy()
+            arrays[name + '.categories'] = np.array(values.cat.categories.tolist(), dtype=str)
+            layout.append((column, 'category'))
+        elif len(values) and isinstance(values.iloc[0], (list, np.ndarray)):
+            arrays[name + '.values'] = np.concatenate(values.to_numpy()).astype(np.float64)
+            arrays[name + '.offsets'] = np.concatenate(([0], np.cumsum(values.map(len).to_numpy())))
+            layout.append((column, 'ragged'))
+        elif pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+            arrays[name] = values.to_numpy()
+            layout.append((column, 'numeric'))
+        else:
+            # strings, with None / NaN kept apart: anything else is not cached
+            none = values.map(lambda value: value is None).to_numpy(dtype=bool)
+            nan = values.isna().to_numpy() & ~none
+            if not values[~(none | nan)].map(lambda value: isinstance(value, str)).all():
+                raise TypeError('column %s is not made of strings' % column)
+            arrays[name] = np.array(values.where(~(none | nan), '').tolist(), dtype=str)
+            arrays[name + '.none'], arrays[name + '.nan'] = none, nan
+            layout.append((column, 'str'))
+    return arrays, layout
+
+def _frame_from_arrays(arrays, layout, prefix):
+    columns = {}
+    for i, (column, kind) in enumerate(layout):
+        name = prefix + str(i)
+        if kind == 'category':
+            columns[column] = pd.Categorical.from_codes(arrays[name + '.codes'], arrays[name + '.categories'].tolist())
+        elif kind == 'ragged':
+            values, offsets = arrays[name + '.values'].tolist(), arrays[name + '.offsets'].tolist()
+            columns[column] = [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+        elif kind == 'str':
+            values = np.array(arrays[name].tolist(), dtype=object)
+            values[arrays[name + '.none']] = None
+            values[arrays[name + '.nan']] = np.nan
+            columns[column] = values
+        else:
+            columns[column] = arrays[name]
+    return pd.DataFrame(columns)
+
+def save(path, key, result):
+    ''' result is a DataFrame or a dict of DataFrames '''
+    frames = result if isinstance(result, dict) else {None: result}
+    arrays, layouts = {}, []
+    for i, (frame_name, df) in enumerate(frames.items()):
+        frame_arrays, layout = _frame_to_arrays(df, 'f%d.c' % i)
+        arrays.update(frame_arrays)
+        layouts.append((frame_name, layout))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, __key__=np.array(key), __layout__=np.array(json.dumps(layouts)), **arrays)
+    os.replace(tmp_path, path)
+
+def load(path, key):
+    ''' returns None if the cache is missing or stale '''
+    if not os.path.exists(path): return None
+    with np.load(path, allow_pickle=False) as arrays:
+        if str(arrays['__key__']) != key: return None
+        layouts = json.loads(str(arrays['__layout__']))
+        frames = {frame_name: _frame_from_arrays(arrays, layout, 'f%d.c' % i)
+                  for i, (frame_name, layout) in enumerate(layouts)}
+    return frames[None] if list(frames) == [None] else frames
+
+def _copy(result):
+    return {k: df.copy() for k, df in result.items()} if isinstance(result, dict) else result.copy()
+
+def _call(loader, xml_file, name, version, span):
+    if not enabled() or not isinstance(xml_file, (str, os.PathLike)):
+        span.note(cache='off')
+        return loader(xml_file)
+
+    path = cache_path(xml_file, name)
+    stat = os.stat(xml_file)
+    memory_key = (version, stat.st_mtime_ns, stat.st_size)
+    if _memory.get(path, (None,))[0] == memory_key:
+        span.note(cache='memory')
+        return _copy(_memory[path][1])
+
+    key = file_key(xml_file, name, version)
+
+    try:
+        result = load(path, key)
+    except (OSError, ValueError, KeyError):
+        result = None
+    span.note(cache='disk' if result is not None else 'parsed')
+    if result is None:
+        result = loader(xml_file)
+        try:
+            save(path, key, result)
+        except (OSError, TypeError):
+            pass
+
+    _memory[path] = (memory_key, result)
+    return _copy(result)
+
+def cached(name, version=1):
+    ''' decorator for loaders taking the xml path as only argument and
+        returning a DataFrame (or a dict of DataFrames). Results are kept
+        in memory for the process and on disk across runs '''
+    def decorator(loader):
+        @functools.wraps(loader)
+        def wrapper(xml_file):
+            with profiling.span('xml.' + name, file=xml_file) as span:
+                return _call(loader, xml_file, name, version, span)
+        return wrapper
+    return decorator